@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""Benchmarks for loading and processing form configurations.
+
+Usage::
+
+    python contrib/benchmark.py inheritance --sizes 100 1000 10000
+    python contrib/benchmark.py load
+    python contrib/benchmark.py import --limit 0.2
+    python contrib/benchmark.py rules
+    python contrib/benchmark.py form --sizes 300
+
+Each benchmark generates a synthetic form configuration of the given
+sizes and prints the best time out of a number of repetitions.
+"""
+import os
+import re
+import sys
+import copy
+import glob
+import shutil
+import timeit
+import subprocess
+import tempfile
+import argparse
+import logging
+import xml.etree.ElementTree as ET
+from formbar import etree
+from formbar.config import load, merge_inherited, Config
+from formbar.form import Form, get_prototype
+from formbar.rules import Expression
+from formbar.rulecompiler import compile_tree
+
+log = logging.getLogger(name="formbar.contrib.benchmark")
+
+
+def _timeit(func, repeat, setup=None):
+    """Returns the best time of calling func. If setup is given it is
+    called before every call and its result is passed to func."""
+    timings = []
+    for i in range(repeat):
+        args = setup() if setup else ()
+        start = timeit.default_timer()
+        func(*args)
+        timings.append(timeit.default_timer() - start)
+    return min(timings)
+
+
+def _report(name, size, timings):
+    out = ["%-12s %6d" % (name, size)]
+    for label, value in timings:
+        out.append("%s: %8.4fs" % (label, value))
+    print "  ".join(out)
+
+
+def _generate_parent(size):
+    """Returns a configuration with size entities and a form which
+    includes all of them."""
+    config = ET.Element("configuration")
+    source = ET.SubElement(config, "source")
+    form = ET.SubElement(config, "form", id="form")
+    page = ET.SubElement(form, "page", id="page")
+    for i in range(size):
+        ET.SubElement(source, "entity", id="e%s" % i, name="f%s" % i)
+        row = ET.SubElement(page, "row")
+        col = ET.SubElement(row, "col")
+        ET.SubElement(col, "field", ref="e%s" % i)
+    return config
+
+
+def _generate_child(size):
+    """Returns a configuration which overwrites every second entity of
+    the parent and adds size / 10 new entities."""
+    config = ET.Element("configuration", inherits="parent.xml")
+    source = ET.SubElement(config, "source")
+    for i in range(0, size, 2):
+        ET.SubElement(source, "entity", id="e%s" % i, name="f%s" % i,
+                      label="Overwritten")
+    for i in range(size, size + size / 10):
+        ET.SubElement(source, "entity", id="e%s" % i, name="f%s" % i)
+    return config
+
+
+def _legacy_merge_inherited(tree, ptree):
+    """Implementation of the merge in handle_inheritance before the
+    parent tree was indexed by id."""
+    tree_parent_map = {c: p for p in tree.iter() for c in p}
+    ptree_parent_map = {c: p for p in ptree.iter() for c in p}
+
+    for element in tree.getiterator():
+        if not "id" in element.attrib:
+            continue
+        xpath = ".//*[@id='%s']" % element.attrib["id"]
+        pelement = ptree.find(xpath)
+        if pelement is not None:
+            pparent = ptree_parent_map.get(pelement)
+            if pparent is not None:
+                pindex = pparent._children.index(pelement)
+                pparent._children[pindex] = element
+        else:
+            parent = tree_parent_map[element]
+            if parent.tag == "configuration":
+                ptree.append(element)
+            elif "id" in parent.attrib:
+                xpath = ".//%s[id='%s']" % (parent.tag, parent.attrib["id"])
+                pelement = ptree.find(xpath)
+                pelement.append(element)
+            else:
+                xpath = "%s" % parent.tag
+                pelement = ptree.find(xpath)
+                pelement.append(element)
+    return ptree
+
+
+def bench_inheritance(args):
+    for size in args.sizes:
+        parent = _generate_parent(size)
+        child = _generate_child(size)
+
+        def setup():
+            return copy.deepcopy(child), copy.deepcopy(parent)
+
+        legacy = ET.tostring(_legacy_merge_inherited(*setup()))
+        indexed = ET.tostring(merge_inherited(*setup()))
+        if legacy != indexed:
+            log.error("Results differ for %s elements" % size)
+            return 1
+        timings = [("legacy", _timeit(_legacy_merge_inherited,
+                                      args.repeat, setup)),
+                   ("indexed", _timeit(merge_inherited,
+                                       args.repeat, setup))]
+        _report("inheritance", size, timings)
+    return 0
+
+
+def bench_load(args):
+    tmpdir = tempfile.mkdtemp()
+    backends = [etree.STDLIB]
+    try:
+        etree.use(etree.LXML)
+        backends.append(etree.LXML)
+    except ValueError:
+        log.warning("lxml is not installed")
+    try:
+        for size in args.sizes:
+            parent = os.path.join(tmpdir, "parent.xml")
+            ET.ElementTree(_generate_parent(size)).write(parent)
+            child = os.path.join(tmpdir, "child.xml")
+            ET.ElementTree(_generate_child(size)).write(child)
+            timings = []
+            for backend in backends:
+                etree.use(backend)
+                timings.append((backend, _timeit(lambda: load(child),
+                                                 args.repeat)))
+            _report("load", size, timings)
+    finally:
+        etree.use()
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+def _generate_conditionals(size):
+    """Returns a configuration with a form of size fields. Every ten
+    fields are in a conditional depending on the first field."""
+    config = _generate_parent(size)
+    page = config.find("form/page")
+    for row in list(page)[1:]:
+        page.remove(row)
+    conditional = None
+    for i in range(1, size):
+        if i % 10 == 1:
+            conditional = ET.SubElement(page, "if",
+                                        expr="$f0 gt %s" % (i / 10))
+        ET.SubElement(conditional, "field", ref="e%s" % i)
+    return config
+
+
+def bench_conditionals(args):
+    for size in args.sizes:
+        form = Config(_generate_conditionals(size)).get_form("form")
+        values = {"f0": size / 20}
+
+        def legacy():
+            form.init_fields(values, evaluate=True)
+
+        timings = [("legacy", _timeit(legacy, args.repeat)),
+                   ("precomputed",
+                    _timeit(lambda: form.get_active_fieldnames(values),
+                            args.repeat))]
+        _report("conditionals", size, timings)
+    return 0
+
+
+def bench_import(args):
+    script = ("import time; start = time.time(); import %s; "
+              "print time.time() - start")
+    for module in args.modules:
+        timings = []
+        for i in range(args.repeat):
+            output = subprocess.check_output([sys.executable, "-c",
+                                              script % module])
+            timings.append(float(output))
+        print "%-20s %8.4fs" % (module, min(timings))
+        if args.limit and min(timings) > args.limit:
+            log.error("Importing %s takes longer than %ss"
+                      % (module, args.limit))
+            return 1
+    return 0
+
+
+def _collect_expressions(paths):
+    """Returns the sorted expressions of all elements with an expr
+    attribute in the given files."""
+    expressions = set()
+    for path in paths:
+        for element in ET.parse(path).iter():
+            if element.get("expr"):
+                expressions.add(element.get("expr"))
+    return sorted(expressions)
+
+
+def _find_values(expr):
+    """Returns values for the variables of the expression which can be
+    evaluated by the interpreter or None."""
+    candidates = [1, 1.0, u"x", True]
+    variables = set(re.findall(r"\$([\w.-]+)", expr._expression))
+    for value in candidates:
+        values = dict((name, value) for name in variables)
+        try:
+            return values, expr._evaluate(expr._expression_tree, values)
+        except Exception:
+            pass
+    return None, None
+
+
+def bench_rules(args):
+    paths = args.files
+    if not paths:
+        base = os.path.join(os.path.dirname(__file__), "..")
+        paths = (glob.glob(os.path.join(base, "test", "*.xml"))
+                 + glob.glob(os.path.join(base, "examples", "*.xml")))
+    # The interpreter logs all failed evaluations.
+    logging.getLogger("brabbel").setLevel(logging.CRITICAL)
+    interpreted_total = compiled_total = 0.0
+    for expression in _collect_expressions(paths):
+        expr = Expression(expression)
+        values, result = _find_values(expr)
+        if values is None:
+            log.warning("Skipping '%s'. No values found to evaluate "
+                        "the expression" % expression)
+            continue
+        compiled = compile_tree(expr._expression_tree, expression)
+        if compiled(values) != result:
+            log.error("Results of '%s' differ" % expression)
+            return 1
+
+        def interpreted():
+            for i in xrange(args.number):
+                expr._evaluate(expr._expression_tree, values)
+
+        def native():
+            for i in xrange(args.number):
+                compiled(values)
+
+        timings = [("interpreted", _timeit(interpreted, args.repeat)),
+                   ("compiled", _timeit(native, args.repeat))]
+        interpreted_total += timings[0][1]
+        compiled_total += timings[1][1]
+        print "%-30s %s" % (expression, "  ".join("%s: %8.4fs" % t
+                                                   for t in timings))
+    print "%-30s interpreted: %8.4fs  compiled: %8.4fs" % (
+        "total", interpreted_total, compiled_total)
+    return 0
+
+
+def bench_form(args):
+    for size in args.sizes:
+        config = _generate_parent(size)
+        # Forms expect pages to be named p<number>
+        config.find("form/page").set("id", "p1")
+        form_config = Config(config).get_form("form")
+        prototype = get_prototype(form_config)
+
+        def construct():
+            for i in xrange(args.number):
+                Form(form_config)
+
+        def create():
+            for i in xrange(args.number):
+                prototype.create()
+
+        def render(form):
+            form.render()
+
+        timings = [("constructor", _timeit(construct, args.repeat)),
+                   ("prototype", _timeit(create, args.repeat)),
+                   ("render", _timeit(render, args.repeat,
+                                      lambda: (Form(form_config),))),
+                   ("render prototype",
+                    _timeit(render, args.repeat,
+                            lambda: (prototype.create(),)))]
+        _report("form", size, timings)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for formbar form configurations')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of repetitions. The best time is used.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    p = subparsers.add_parser('inheritance',
+                              help='Merge of inherited configurations')
+    p.add_argument('--sizes', type=int, nargs='+',
+                   default=[100, 1000, 10000],
+                   help='Number of entities in the configuration')
+    p.set_defaults(func=bench_inheritance)
+
+    p = subparsers.add_parser('load',
+                              help='Loading of configurations per backend')
+    p.add_argument('--sizes', type=int, nargs='+',
+                   default=[100, 1000, 10000],
+                   help='Number of entities in the configuration')
+    p.set_defaults(func=bench_load)
+
+    p = subparsers.add_parser('conditionals',
+                              help='Evaluation of the active fields')
+    p.add_argument('--sizes', type=int, nargs='+',
+                   default=[100, 1000],
+                   help='Number of fields in the form')
+    p.set_defaults(func=bench_conditionals)
+
+    p = subparsers.add_parser('import',
+                              help='Import time of modules in a new '
+                              'interpreter')
+    p.add_argument('--modules', nargs='+',
+                   default=['formbar', 'formbar.config', 'formbar.form'],
+                   help='Modules to import')
+    p.add_argument('--limit', type=float,
+                   help='Fail if importing a module takes longer than '
+                   'limit seconds')
+    p.set_defaults(func=bench_import)
+
+    p = subparsers.add_parser('rules',
+                              help='Interpreted and compiled evaluation of '
+                              'the rules in the test forms')
+    p.add_argument('--number', type=int, default=10000,
+                   help='Number of evaluations of every rule')
+    p.add_argument('files', nargs='*',
+                   help='Form configurations with the rules. Defaults to '
+                   'the forms in test and examples')
+    p.set_defaults(func=bench_rules)
+
+    p = subparsers.add_parser('form',
+                              help='Construction of forms with and without '
+                              'a prototype')
+    p.add_argument('--sizes', type=int, nargs='+', default=[300],
+                   help='Number of fields in the form')
+    p.add_argument('--number', type=int, default=10,
+                   help='Number of forms constructed per repetition')
+    p.set_defaults(func=bench_form)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
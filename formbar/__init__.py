@@ -1,12 +1,10 @@
-import pkg_resources
 import os
 import logging
 
-# @XXX: How to set the log level from within the application which uses
-# formbar?
-logging.basicConfig()
+# Logging is configured by the application which uses formbar.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
 
-base_dir = pkg_resources.get_distribution("formbar").location
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 template_dir = os.path.join(base_dir, 'formbar', 'templates')
 static_dir = os.path.join(base_dir, 'formbar', 'static')
 test_dir = os.path.join(base_dir, 'test')
@@ -0,0 +1,295 @@
+"""Precompiled form configuration bundles.
+
+A bundle is a binary artifact containing a form configuration which has
+already been loaded and resolved. It includes the resolved tree
+(inheritance, includes and entity prefixes applied), the fields per page,
+the id to name mapping and the conditionals of every form and the rules
+and validators of every entity. Loading a bundle therefore only needs to
+deserialize the data instead of resolving and walking the configuration
+again. A bundle also contains the SHA1 hashes of the configuration and
+of all files it depends on, so outdated bundles can be detected.
+
+Bundles are usually built as part of the deployment using the
+``formbar-compile`` command::
+
+    formbar-compile -j 4 @myapp/views/forms
+
+and are loaded in the application with::
+
+    from formbar import bundle
+    config = bundle.load_config("/path/to/form.xml")
+
+The file starts with a header containing a magic string, the version of
+the file format and of the compiler and a SHA1 hash of the content.
+Bundles with a different format or compiler version are rejected and
+must be compiled again.
+
+.. warning::
+   The content of a bundle is stored as pickle. Never load bundles
+   from untrusted sources.
+"""
+import os
+import sys
+import struct
+import hashlib
+import logging
+import argparse
+import multiprocessing
+import cPickle as pickle
+from formbar import etree
+from formbar.config import Config, Field, load as load_xml, get_file_location
+
+log = logging.getLogger(__name__)
+
+MAGIC = "FBAR"
+FORMAT_VERSION = 1
+"""Version of the file format of the bundle."""
+COMPILER_VERSION = 4
+"""Version of the compiler. Must be increased whenever the compiled
+data changes."""
+SUFFIX = ".fbc"
+"""Suffix of compiled bundles."""
+
+_header = struct.Struct("!4sHH20s")
+
+
+class BundleError(Exception):
+    """Exception raised for invalid or outdated bundles."""
+    pass
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _compile_form(form):
+    pages = []
+    roots = form.get_pages()
+    if len(roots) == 0:
+        roots.append(form._tree)
+    for page in roots:
+        refs = [node.attrib.get('ref') for node in form.walk(page, {})]
+        pages.append((page.attrib.get("id"), refs))
+    return {"pages": pages, "id2name": dict(form._id2name),
+            "conditionals": form.dump_conditionals()}
+
+
+def _compile_entity(field):
+    return {"rules": field.get_rule_specs(),
+            "constraints": field.get_constraint_specs(),
+            "validators": field.get_validators()}
+
+
+def compile_config(path):
+    """Returns a dictionary with the compiled data of the form
+    configuration in path.
+
+    :path: Path of the form configuration
+    :returns: Dictionary with the compiled configuration
+    """
+    deps = {}
+    tree = load_xml(path, deps)
+    if tree.tag != "configuration":
+        raise BundleError("'%s' is not a form configuration" % path)
+    config = Config(tree)
+    forms = {}
+    for element in config.get_elements('form'):
+        id = element.attrib.get("id")
+        if id is None or id in forms:
+            continue
+        try:
+            forms[id] = _compile_form(config.get_form(id))
+        except KeyError:
+            forms[id] = None
+            log.warning("Ignoring form '%s' in '%s' on compilation"
+                        % (id, path))
+    forms = dict((id, form) for id, form in forms.iteritems() if form)
+    entities = {}
+    for entity in config.get_elements('entity'):
+        id = entity.attrib.get("id")
+        if id is not None:
+            entities[id] = _compile_entity(Field(entity))
+    basepath = os.path.dirname(os.path.abspath(path))
+    return {"source": os.path.basename(path),
+            "deps": sorted((os.path.relpath(dep, basepath), _digest(dep))
+                           for dep in deps),
+            "tree": etree.tostring(tree, encoding="utf-8"),
+            "forms": forms,
+            "entities": entities}
+
+
+def dumps(compiled):
+    """Returns the binary bundle for the given compiled data.
+
+    :compiled: Dictionary with the compiled data
+    :returns: String
+    """
+    payload = pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha1(payload).digest()
+    header = _header.pack(MAGIC, FORMAT_VERSION, COMPILER_VERSION, digest)
+    return header + payload
+
+
+def loads(data):
+    """Returns the compiled data of the given binary bundle. Raises a
+    :class:`BundleError` if the bundle is invalid or was compiled with
+    a different version.
+
+    :data: String with the bundle
+    :returns: Dictionary with the compiled data
+    """
+    if len(data) < _header.size:
+        raise BundleError("Bundle is truncated")
+    magic, fmt, compiler, digest = _header.unpack(data[:_header.size])
+    if magic != MAGIC:
+        raise BundleError("Not a formbar bundle")
+    if fmt != FORMAT_VERSION or compiler != COMPILER_VERSION:
+        raise BundleError("Bundle was compiled with version %s/%s. "
+                          "Version %s/%s is required"
+                          % (fmt, compiler, FORMAT_VERSION, COMPILER_VERSION))
+    payload = data[_header.size:]
+    if hashlib.sha1(payload).digest() != digest:
+        raise BundleError("Content hash of the bundle does not match")
+    return pickle.loads(payload)
+
+
+def compile_file(path, out=None):
+    """Compiles the form configuration in path and writes the bundle
+    into out. If out is not given the bundle is written next to the
+    configuration.
+
+    :path: Path of the form configuration
+    :out: Path of the bundle
+    :returns: Path of the bundle
+    """
+    if out is None:
+        out = path + SUFFIX
+    data = dumps(compile_config(path))
+    with open(out, "wb") as f:
+        f.write(data)
+    return out
+
+
+def check(compiled, source):
+    """Raises a :class:`BundleError` if the form configuration or one of
+    the files it depends on has been changed or removed since the
+    bundle was compiled.
+
+    :compiled: Dictionary with the compiled data
+    :source: Path of the form configuration of the bundle
+    """
+    basepath = os.path.dirname(os.path.abspath(source))
+    for dep, digest in compiled["deps"]:
+        path = os.path.normpath(os.path.join(basepath, dep))
+        try:
+            if _digest(path) == digest:
+                continue
+        except IOError:
+            pass
+        raise BundleError("'%s' has changed since compilation" % path)
+
+
+def load(path, source=None):
+    """Returns a :class:`formbar.config.Config` for the bundle in
+    path. If source is given the bundle is rejected with a
+    :class:`BundleError` if the form configuration or one of its
+    dependencies has changed since compilation.
+
+    :path: Path of the bundle
+    :source: Optional path of the form configuration of the bundle
+    :returns: :class:`formbar.config.Config`
+    """
+    with open(path, "rb") as f:
+        compiled = loads(f.read())
+    if source is not None:
+        check(compiled, source)
+    return Config(etree.fromstring(compiled["tree"]), compiled)
+
+
+def load_config(path):
+    """Returns a :class:`formbar.config.Config` for the form
+    configuration in path. If a valid bundle is found next to the
+    configuration and neither the configuration nor its dependencies
+    have changed since compilation the bundle is loaded. Otherwise the
+    configuration is loaded from the XML file.
+
+    :path: Path of the form configuration
+    :returns: :class:`formbar.config.Config`
+    """
+    bundle = path + SUFFIX
+    if os.path.exists(bundle):
+        try:
+            return load(bundle, path)
+        except BundleError as ex:
+            log.warning("Ignoring bundle '%s': %s" % (bundle, ex))
+    return Config(load_xml(path))
+
+
+def _find_configs(location):
+    """Returns a list of tuples with the path and the path relative to
+    the given location of all form configurations in location."""
+    path = get_file_location(location, os.getcwd())
+    if os.path.isfile(path):
+        return [(path, os.path.basename(path))]
+    found = []
+    for root, dirs, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith(".xml"):
+                filepath = os.path.join(root, name)
+                found.append((filepath, os.path.relpath(filepath, path)))
+    return found
+
+
+def _compile_job(job):
+    path, out = job
+    try:
+        return path, compile_file(path, out), None
+    except Exception as ex:
+        return path, None, ex
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compile form configurations into bundles')
+    parser.add_argument('locations', metavar='location', nargs='+',
+                        help='Form configuration file or directory. '
+                        'Locations can be given relative to a package '
+                        'e.g "@myapp/views/forms"')
+    parser.add_argument('-o', '--output', metavar='dir',
+                        help='Write the bundles into this directory. '
+                        'Defaults to the directory of the configuration.')
+    parser.add_argument('-j', '--jobs', metavar='n', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of parallel jobs')
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for location in args.locations:
+        for path, relpath in _find_configs(location):
+            out = None
+            if args.output:
+                out = os.path.join(args.output, relpath + SUFFIX)
+                if not os.path.exists(os.path.dirname(out)):
+                    os.makedirs(os.path.dirname(out))
+            jobs.append((path, out))
+
+    failed = 0
+    pool = multiprocessing.Pool(max(1, args.jobs))
+    try:
+        for path, out, ex in pool.imap_unordered(_compile_job, jobs):
+            if ex is None:
+                print "Compiled %s -> %s" % (path, out)
+            elif isinstance(ex, BundleError):
+                print "Skipped %s: %s" % (path, ex)
+            else:
+                failed += 1
+                print >> sys.stderr, "Failed %s: %s" % (path, ex)
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
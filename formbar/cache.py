@@ -0,0 +1,204 @@
+"""Process wide cache for loaded form configurations.
+
+Loading a form configuration with :func:`formbar.config.load` means
+reading and parsing the XML file and resolving all inherited and
+included files. The cache in this module keeps the fully resolved tree
+of a configuration in memory and only loads it again if one of the
+files the configuration depends on has been modified. Example::
+
+    from formbar import cache
+    from formbar.config import Config
+
+    config = Config(cache.load("/path/to/form.xml"))
+
+Please note that the returned tree is shared between all callers and
+must be considered read-only.
+
+:func:`get_config` additionally caches the :class:`formbar.config.Config`
+of the configuration. As the form configurations returned by
+:meth:`formbar.config.Config.get_form` are only initialized once per
+config this avoids initializing the form configuration on every
+request::
+
+    form_config = cache.get_config("/path/to/form.xml").get_form("myform")
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+import formbar.config
+
+log = logging.getLogger(__name__)
+
+
+class CacheEntry(object):
+    """Single entry of the :class:`ConfigCache`."""
+
+    def __init__(self, tree, deps):
+        """
+        :tree: Fully resolved ElementTree of the configuration.
+        :deps: Dictionary with the path and modification time of all
+               files the configuration depends on.
+        """
+        self.tree = tree
+        self.deps = deps
+        self.config = None
+
+    def is_current(self):
+        """Returns True if none of the files the configuration depends
+        on has been modified or removed since it was loaded."""
+        for path, mtime in self.deps.iteritems():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+
+class ConfigCache(object):
+    """Thread safe LRU cache of fully resolved form configurations. The
+    entries are keyed by the absolute path of the configuration file.
+    An entry is considered stale if the modification time of one of
+    the files it depends on has changed."""
+
+    def __init__(self, maxsize=128):
+        """
+        :maxsize: Maximum number of configurations kept in the cache.
+                  If the limit is reached the least recently used
+                  configuration is evicted.
+        """
+        self.maxsize = maxsize
+        self.check_mtime = True
+        """If True the modification time of the files a configuration
+        depends on is checked on every access. This can be disabled if
+        the cache is invalidated by a :class:`formbar.watcher.Watcher`.
+        """
+        self.listeners = []
+        """List of functions which are called with the path and the
+        dependencies of every configuration loaded into the cache."""
+        self._entries = OrderedDict()
+        self._dependents = {}
+        """Dictionary with the paths of the cached configurations
+        depending on a file"""
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._entries
+
+    def _add(self, path, entry):
+        self._remove(path)
+        self._entries[path] = entry
+        for dep in entry.deps:
+            self._dependents.setdefault(dep, set()).add(path)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        for dep in entry.deps:
+            dependents = self._dependents[dep]
+            dependents.discard(path)
+            if not dependents:
+                del self._dependents[dep]
+
+    def _get_entry(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and (not self.check_mtime
+                                      or entry.is_current()):
+                # Mark the entry as most recently used.
+                del self._entries[path]
+                self._entries[path] = entry
+                return entry
+        log.debug("Loading form configuration '%s'" % path)
+        deps = {}
+        tree = formbar.config.load(path, deps)
+        entry = CacheEntry(tree, deps)
+        with self._lock:
+            self._add(path, entry)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        for listener in self.listeners:
+            listener(path, deps)
+        return entry
+
+    def load(self, path):
+        """Returns the fully resolved tree of the configuration in
+        path. The configuration is only loaded if it is not already
+        in the cache or if the cached version is outdated.
+
+        :path: Path of the configuration file
+        :returns: ElementTree
+        """
+        return self._get_entry(path).tree
+
+    def get_config(self, path):
+        """Returns the :class:`formbar.config.Config` for the
+        configuration in path. The config is shared between all callers
+        as long as the configuration is not modified.
+
+        :path: Path of the configuration file
+        :returns: :class:`formbar.config.Config`
+        """
+        entry = self._get_entry(path)
+        with self._lock:
+            if entry.config is None:
+                entry.config = formbar.config.Config(entry.tree)
+            return entry.config
+
+    def dependencies(self):
+        """Returns a dictionary with the path and the modification time
+        of all files the cached configurations depend on. If
+        configurations have been loaded with different versions of a
+        file the oldest modification time is returned."""
+        deps = {}
+        with self._lock:
+            for entry in self._entries.itervalues():
+                for dep, mtime in entry.deps.iteritems():
+                    deps[dep] = min(mtime, deps.get(dep, mtime))
+        return deps
+
+    def invalidate(self, path=None):
+        """Removes configurations from the cache. If no path is given
+        the whole cache is cleared. Otherwise the configuration of the
+        given path and all configurations which depend on it (e.g
+        because they include or inherit the file) are removed.
+
+        :path: Path of a configuration file
+        :returns: List with the paths of the removed configurations
+        """
+        with self._lock:
+            if path is None:
+                removed = list(self._entries)
+            else:
+                path = os.path.abspath(path)
+                removed = list(self._dependents.get(path, ()))
+            for key in removed:
+                self._remove(key)
+        return removed
+
+cache = ConfigCache()
+"""Default process wide cache"""
+
+
+def load(path):
+    """Returns the fully resolved tree of the configuration in path
+    using the default cache. See :meth:`ConfigCache.load`."""
+    return cache.load(path)
+
+
+def get_config(path):
+    """Returns the config of the configuration in path using the
+    default cache. See :meth:`ConfigCache.get_config`."""
+    return cache.get_config(path)
+
+
+def invalidate(path=None):
+    """Invalidates configurations in the default cache. See
+    :meth:`ConfigCache.invalidate`."""
+    return cache.invalidate(path)
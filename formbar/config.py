@@ -1,16 +1,28 @@
 import os
 import re
+import copy
 import gettext
 import logging
-import pkg_resources
-import xml.etree.ElementTree as ET
-from formbar.rules import Rule
+import threading
+from formbar import etree
+from formbar import locations
+from formbar.rules import Rule, BoolRule, Expression, constraint_rules
 
 log = logging.getLogger(__name__)
 _ = gettext.gettext
 
 required_msg = _("This field is required. You must provide a value")
 desired_msg = _("This field is desired. Please provide a value")
+constraint_msgs = {
+    "minlength": _("The value must have at least %s characters"),
+    "maxlength": _("The value must not have more than %s characters"),
+    "min": _("The value must be greater than or equal to %s"),
+    "max": _("The value must be less than or equal to %s"),
+    "pattern": _("The value does not match the required format"),
+    "options": _("The value is not one of the allowed options")
+}
+constraint_attributes = ["minlength", "maxlength", "min", "max", "pattern"]
+"""Attributes of an entity which define constraints of the field"""
 
 
 def get_text_and_html_content(item):
@@ -20,50 +32,69 @@ def get_text_and_html_content(item):
 
     """
     if len(item) > 0 and item[0].tag == "html":
-        content = ET.tostring(item[0], method="html")
+        content = etree.tostring(item[0], method="html")
         return content.replace("html>", "span>")
     return item.text
 
 
-def load(path):
+def load(path, deps=None):
     """Return the parsed XML form the given file. The function will load
-    the file located in path and than returns the parsed content."""
+    the file located in path and than returns the parsed content.
+
+    :path: Path of the file to load
+    :deps: Optional dictionary. If given the path and modification time
+    of every file read while loading the configuration (the file itself,
+    inherited and included files) is recorded in it.
+    :returns: DOM of the parsed XML
+    """
+    if deps is not None:
+        deps[os.path.abspath(path)] = os.path.getmtime(path)
     with open(path) as f:
         data = f.read()
-        return parse(data, path)
+        return parse(data, path, deps)
 
 
-def parse(xml, path=None):
+def parse(xml, path=None, deps=None):
     """Returns the parsed XML. This is a helper function to be used in
     connection with loading the configuration files.
     :xml: XML string to be parsed
+    :path: Path of the loaded form
+    :deps: Optional dictionary to record files the form depends on.
     :returns: DOM of the parsed XML
 
     """
     if isinstance(xml, unicode):
         xml = xml.encode("utf-8")
-    tree = ET.fromstring(xml)
-    tree = handle_inheritance(tree, path)
-    tree = handle_includes(tree, path)
+    tree = etree.fromstring(xml)
+    tree = handle_inheritance(tree, path, deps)
+    tree = handle_includes(tree, path, deps)
     return tree
 
 
 def get_file_location(location, basepath):
+    """Returns the path of the file at the given location. See
+    :mod:`formbar.locations` for package relative locations.
+
+    :location: Location of the file
+    :basepath: Path used for relative locations
+    :returns: Path of the file
+    """
     if location.startswith("@"):
         path = location.split("/")
-        app = pkg_resources.get_distribution(path[0].strip("@")).location
+        app = locations.resolve(path[0].strip("@"))
         return os.path.join(app, *path[1::])
     elif not os.path.isabs(location):
         return os.path.join(basepath, location)
     return location
 
 
-def handle_inheritance(tree, path=None):
+def handle_inheritance(tree, path=None, deps=None):
     """Will build a form based on a parent form. Will replace elements
     overwritten in the inherited form and add new elements.
 
     :tree: ElementTree
     :path: Path of the loaded form
+    :deps: Optional dictionary to record files the form depends on.
     :returns: ElementTree
 
     """
@@ -74,58 +105,174 @@ def handle_inheritance(tree, path=None):
 
     if not "inherits" in tree.attrib:
         return tree
-    ptree = load(get_file_location(tree.attrib["inherits"], basepath))
+    ptree = load(get_file_location(tree.attrib["inherits"], basepath), deps)
+    ptree = merge_inherited(tree, ptree)
+    ptree = handle_includes(ptree, path, deps)
+    return ptree
 
-    # Workaroutn for missing support of getting parent elements. See
-    # http://stackoverflow.com/
-    # questions/2170610/access-elementtree-node-parent-node/2170994
-    tree_parent_map = {c: p for p in tree.iter() for c in p}
-    ptree_parent_map = {c: p for p in ptree.iter() for c in p}
 
-    for element in tree.getiterator():
-        if not "id" in element.attrib:
-            continue
-        # Is there a an element with the same id in the ptree?
-        xpath = ".//*[@id='%s']" % element.attrib["id"]
-        pelement = ptree.find(xpath)
-        if pelement is not None:
-            # Replace the parent element with the one in inherited
-            # element.
-            pparent = ptree_parent_map.get(pelement)
-            if pparent is not None:
-                pindex = pparent._children.index(pelement)
-                pparent._children[pindex] = element
-        else:
-            # Add the element to the parent tree
-            # 1. First get the parent of the new element and get the
-            # same element from the parent tree.
-            parent = tree_parent_map[element]
-            if "id" in parent.attrib:
-                xpath = ".//%s[id='%s']" % (parent.tag, parent.attrib["id"])
-            else:
-                xpath = "%s" % parent.tag
-
-            if parent.tag == "configuration":
-                ptree.append(element)
-            elif "id" in parent.attrib:
-                xpath = ".//%s[id='%s']" % (parent.tag, parent.attrib["id"])
-                pelement = ptree.find(xpath)
-                pelement.append(element)
-            else:
-                xpath = "%s" % parent.tag
-                pelement = ptree.find(xpath)
-                pelement.append(element)
-
-    ptree = handle_includes(ptree, path)
+def _build_id_index(tree):
+    """Returns a tuple of two dictionaries. The first maps the id of
+    every element below the root of the tree to a list of tuples
+    (element, parent, index) in document order. The second maps every
+    element below the root to a tuple (start, end, depth) with the
+    position of the element and of its last descendant in document
+    order."""
+    index = {}
+    spans = {}
+    position = [0]
+
+    def visit(parent, depth):
+        for pos, child in enumerate(parent):
+            position[0] += 1
+            start = position[0]
+            id = child.attrib.get("id")
+            if id is not None:
+                index.setdefault(id, []).append((child, parent, pos))
+            visit(child, depth + 1)
+            spans[child] = (start, position[0], depth)
+
+    visit(tree, 1)
+    return index, spans
+
+
+def merge_inherited(tree, ptree):
+    """Merges the elements of the inherited tree into the parent tree.
+    Elements with an id which is already present in the parent tree
+    replace the first element with this id in the parent tree. Other
+    elements with an id are added to the corresponding element of the
+    parent tree.
+
+    Elements are looked up in an index of the parent tree which is built
+    once so merging is linear in the size of both trees.
+
+    :tree: ElementTree of the inheriting form
+    :ptree: ElementTree of the parent form. Will be modified.
+    :returns: ElementTree
+    """
+    index, spans = _build_id_index(ptree)
+    # Elements of the parent tree which have been removed from the
+    # tree because they or one of their ancestors have been replaced.
+    detached = set()
+    # Spans of the replaced elements of the parent tree in the order of
+    # replacement.
+    replaced = []
+    # Elements of the inheriting tree which are part of the parent tree
+    # per id as tuples (position, number of replacements before the
+    # element was added). Positions are tuples which sort in the
+    # document order of the parent tree: An element which replaces
+    # another element gets the position of the replaced element. An
+    # added element is positioned after the last descendant of the
+    # element it is added to and before elements added to its
+    # ancestors.
+    placed = {}
+    # Positions of the merged elements of the inheriting tree.
+    positions = {}
+    # Direct children of the root of the parent tree per tag. Used to
+    # find the element to which new elements are added.
+    toplevel = {}
+
+    def is_placed(position, count):
+        """Returns False if the element at the position has been removed
+        by a later replacement of one of its ancestors."""
+        for start, end, depth in replaced[count:]:
+            if (start,) <= position <= (end, 1, -depth):
+                return False
+        return True
+
+    def place(element, position):
+        positions[element] = position
+        entry = position, len(replaced)
+        for child in element.iter():
+            id = child.attrib.get("id")
+            if id is not None:
+                placed.setdefault(id, []).append(entry)
+        return entry
+
+    def lookup(id):
+        """Returns the first element with the id in the current parent
+        tree as tuple (element, parent, index). Returns True if this is
+        an element of the inheriting tree and None if there is none."""
+        found = None
+        for pelement, pparent, pindex in index.get(id, ()):
+            if pelement not in detached:
+                found = pelement, pparent, pindex
+                break
+        others = [position for position, count in placed.get(id, ())
+                  if is_placed(position, count)]
+        if others and (found is None
+                       or min(others) < (spans[found[0]][0],)):
+            return True
+        return found
+
+    def merge(element, parent, merged):
+        # Elements are part of the parent tree as long as one of their
+        # merged ancestors has not been replaced.
+        merged = tuple(entry for entry in merged if is_placed(*entry))
+        id = element.attrib.get("id")
+        if id is not None:
+            found = lookup(id)
+            if found is True:
+                # The element or an element with the same id is already
+                # part of the parent tree.
+                pass
+            elif found is not None:
+                # Replace the parent element with the one in inherited
+                # element.
+                pelement, pparent, pindex = found
+                new = element
+                if merged:
+                    # The element is already part of the parent tree
+                    # as a descendant of a merged element.
+                    new = copy.deepcopy(element)
+                detached.update(pelement.iter())
+                start, end, depth = spans[pelement]
+                replaced.append((start, end, depth))
+                etree.replace(pparent, pindex, pelement, new)
+                merged += (place(new, (start,)),)
+                if pparent is ptree:
+                    toplevel.clear()
+            elif not merged:
+                # Add the element to the parent tree. The element is
+                # added to the first element in the parent tree with
+                # the same tag as the parent of the new element.
+                if parent.tag == "configuration":
+                    ptree.append(element)
+                    position = (float("inf"),)
+                else:
+                    pelement = toplevel.get(parent.tag)
+                    if pelement is None:
+                        pelement = ptree.find(parent.tag)
+                        if pelement is not None:
+                            toplevel[parent.tag] = pelement
+                    pelement.append(element)
+                    if pelement in positions:
+                        position = positions[pelement]
+                    else:
+                        start, end, depth = spans[pelement]
+                        position = (end, 1, -depth)
+                merged += (place(element, position),)
+        # Children of merged elements are already part of the parent
+        # tree.
+        for child in list(element):
+            merge(child, element, merged)
+
+    for child in list(tree):
+        merge(child, tree, ())
     return ptree
 
 
-def handle_includes(tree, path):
+def handle_includes(tree, path, deps=None):
     """Will replace all include element with the content of the include
     file.
 
+    Every included file is only loaded once. The included content is
+    prepared once per combination of file, element and entity prefix
+    and a copy of it is inserted for every include element.
+
     :tree: ElementTree
     :path: Path of the loaded form
+    :deps: Optional dictionary to record files the form depends on.
     :returns: ElementTree
 
     """
@@ -134,32 +281,52 @@ def handle_includes(tree, path):
     else:
         basepath = ""
 
-    # Workaroutn for missing support of getting parent elements. See
-    # http://stackoverflow.com/
-    # questions/2170610/access-elementtree-node-parent-node/2170994
-    parent_map = {c: p for p in tree.iter() for c in p}
+    # Loaded files and prepared content per (path, element, prefix).
+    sources = {}
+    subtrees = {}
+
+    def get_include(location, element, entity_prefix, placeholder):
+        filepath = os.path.abspath(get_file_location(location, basepath))
+        key = (filepath, element, entity_prefix)
+        if key in subtrees:
+            return subtrees[key]
+        include_tree = sources.get(filepath)
+        if include_tree is None:
+            include_tree = load(filepath, deps)
+            sources[filepath] = include_tree
+        if entity_prefix is not None:
+            include_tree = handle_entity_prefix(copy.deepcopy(include_tree),
+                                                entity_prefix)
+        if element is not None:
+            include_tree = etree.find_by_id(include_tree, element)
+            if include_tree is None:
+                err = ('Element "%s" included in line %s can not be found '
+                       'in "%s"' % (element, etree.sourceline(placeholder),
+                                    location))
+                log.error(err)
+                raise ValueError(err)
+        subtrees[key] = include_tree
+        return include_tree
+
+    getparent = etree.getparent(tree)
     # handle includes in form
     for include_placeholder in tree.findall(".//include"):
         location = include_placeholder.attrib["src"]
         entity_prefix = include_placeholder.attrib.get("entity-prefix")
         element = include_placeholder.attrib.get("element")
-        include_tree = load(get_file_location(location, basepath))
-
-        if entity_prefix is not None:
-            include_tree = handle_entity_prefix(include_tree, entity_prefix)
-
-        if element is not None:
-            include_tree = include_tree.find(".//*[@id='%s']" % element)
-        parent = parent_map[include_placeholder]
-        index = parent._children.index(include_placeholder)
+        include_tree = copy.deepcopy(get_include(location, element,
+                                                 entity_prefix,
+                                                 include_placeholder))
+        parent = getparent(include_placeholder)
         # Check if the content to be included is wrapped in a
         # 'configuration' section.
         if include_tree.tag == "configuration":
-            parent.remove(parent._children[index])
-            for child in include_tree:
+            parent.remove(include_placeholder)
+            for child in list(include_tree):
                 parent.append(child)
         else:
-            parent._children[index] = include_tree
+            index = etree.index(parent, include_placeholder)
+            etree.replace(parent, index, include_placeholder, include_tree)
     return tree
 
 
@@ -180,7 +347,7 @@ def handle_entity_prefix(tree, prefix):
         return m.group(0)
 
     for n in tree.iter():
-        if not ET.iselement(n):
+        if not etree.iselement(n):
             continue
         if n.tag == "entity":
             # Handle fields
@@ -221,11 +388,7 @@ def filter_form_fields(form, fields, values=None):
     conditional will evaluate to true using the given set of values."""
     if values is None:
         values = {}
-    # FIXME: The only way get only fields which are
-    # relevant (e.g in evaluable conditionals) is to "reinit"
-    # the fields.
-    filtered_fields = flatten_form_fields(form.init_fields(values,
-                                                           evaluate=True))
+    filtered_fields = form.get_active_fieldnames(values)
     tmp_fields = {}
     for fieldname, field in fields.iteritems():
         if fieldname in filtered_fields:
@@ -237,15 +400,17 @@ class Config(object):
     """Class for accessing the form configuration file. It provides methods to
     get certain elements from the configuration. """
 
-    def __init__(self, tree):
+    def __init__(self, tree, compiled=None):
         """Initialize a configuration with the DOM tree of an XML configuration
         for the form. If tree is not an instance of an ElementTree than raise a
         TypeError
 
         :tree: XML DOM tree of the configuration file
+        :compiled: Optional dictionary with precompiled data of the
+        configuration. See :mod:`formbar.bundle`.
 
         """
-        if isinstance(tree, ET.Element):
+        if etree.iselement(tree):
             self._tree = tree
         else:
             err = ('Config must instanciated with a '
@@ -253,21 +418,78 @@ class Config(object):
             log.error(err)
             raise ValueError(err)
 
+        self._compiled = compiled
+        """Precompiled data of the configuration. None if the
+        configuration was not loaded from a bundle."""
+
+        self._forms = {}
+        """Dictionary with the already initialized form configurations"""
+        self._forms_lock = threading.Lock()
+
         self.build_index()
 
     def build_index(self):
+        """Builds the index of the elements in the tree. Elements are
+        indexed by their tag and by their tag and id. References of
+        elements to other elements of the same tag (by the 'ref'
+        attribute) are resolved while building the index so looking up
+        an element by its id does not need to search the tree."""
         index = {}
+        ids = {}
 
         for node in self._tree.iter():
-            if not ET.iselement(node):
+            if not etree.iselement(node):
                 continue
             elems = index.get(node.tag)
             if elems is None:
                 elems = []
                 index[node.tag] = elems
             elems.append(node)
+            id = node.attrib.get('id')
+            if id:
+                ids.setdefault((node.tag, id), []).append(node)
 
         self.index = index
+        self._resolved = {}
+        """Dictionary with the resolved element for (tag, id)"""
+        self._unresolvable = {}
+        """Dictionary with the error message for (tag, id) which can
+        not be resolved because they are ambigous or circular"""
+        for key in ids:
+            self._resolve(key, ids)
+
+    def _resolve(self, key, ids):
+        """Resolves the 'ref' chain of the element with (tag, id) in key
+        and stores the result for every element in the chain."""
+        chain = []
+        result = error = None
+        while True:
+            if key in self._resolved:
+                result = self._resolved[key]
+                break
+            if key in self._unresolvable:
+                error = self._unresolvable[key]
+                break
+            elems = ids.get(key)
+            if elems is None:
+                break
+            chain.append(key)
+            if len(elems) > 1:
+                error = 'Element is ambigous %s:' % key[1]
+                break
+            ref = elems[0].attrib.get('ref')
+            if not ref:
+                result = elems[0]
+                break
+            key = (key[0], ref)
+            if key in chain:
+                error = 'Element reference is circular %s:' % ref
+                break
+        for key in chain:
+            if error is None:
+                self._resolved[key] = result
+            else:
+                self._unresolvable[key] = error
 
     def get_elements(self, name):
         """Returns a list of all elements found in the tree with the given
@@ -294,11 +516,14 @@ class Config(object):
         :returns: ``Element`` or ``None``.
 
         """
+        if id:
+            key = (name, id)
+            if key in self._unresolvable:
+                raise KeyError(self._unresolvable[key])
+            return self._resolved.get(key)
         result = self.index.get(name)
         if result is None:
             return None
-        if id:
-            result = [x for x in result if x.attrib.get('id') == id]
         if len(result) > 1:
             raise KeyError('Element is ambigous %s:' % id)
         elif len(result) == 1:
@@ -316,32 +541,75 @@ class Config(object):
         with id in the configuration file. If the form can not be found a
         KeyError is raised.
 
+        The form configuration is only initialized on the first call.
+        Later calls return the same instance. The instance is read-only
+        and can be shared between multiple :class:`formbar.form.Form`
+        instances and threads.
+
         :id: ID of the form in the configuration file
         :returns: ``FormConfig`` instance
 
         """
-        element = self.get_element('form', id)
-        if element is None:
-            err = 'Form with id "%s" can not be found' % id
-            log.error(err)
-            raise KeyError(err)
-        return Form(element, self)
+        form = self._forms.get(id)
+        if form is not None:
+            return form
+        with self._forms_lock:
+            form = self._forms.get(id)
+            if form is None:
+                element = self.get_element('form', id)
+                if element is None:
+                    err = 'Form with id "%s" can not be found' % id
+                    log.error(err)
+                    raise KeyError(err)
+                compiled = None
+                if self._compiled:
+                    compiled = self._compiled["forms"].get(id)
+                form = Form(element, self, compiled)
+                self._forms[id] = form
+        return form
+
+    def get_compiled_entity(self, id):
+        """Returns the precompiled data of the entity with the given id
+        or None if the configuration was not loaded from a bundle.
+
+        :id: ID of the entity
+        :returns: Dictionary or None
+        """
+        if self._compiled:
+            return self._compiled["entities"].get(id)
+        return None
+
+
+def _get_conditional_rule(expr):
+    """Returns the rule for the expression of a conditional or None if
+    the expression can not be parsed."""
+    try:
+        return Rule(expr)
+    except Exception:
+        log.warning("Can not parse conditional '%s'" % expr)
+        return None
 
 
 class Form(Config):
     """Class for accessing the configuration of a specific form. The form
-    configuration only provides a subset of available attributes for forms."""
+    configuration only provides a subset of available attributes for forms.
 
-    def __init__(self, tree, parent):
+    The form configuration can not be modified after it has been
+    initialized."""
+
+    def __init__(self, tree, parent, compiled=None):
         """Initialize a form configuration with the DOM tree of a XML form
         configuration. On initialisation the form will be configured that means
         that all included fields will be configured.
 
         :tree: XML DOM tree of the form configuration.
         :parent: XML DOM tree of the parent configuration.
+        :compiled: Optional dictionary with the precompiled fields of
+        the form. If given the fields are not collected by walking the
+        form.
 
         """
-        Config.__init__(self, tree)
+        Config.__init__(self, tree, compiled)
 
         self._parent = parent
         """Reference to parent configuration"""
@@ -377,12 +645,29 @@ class Form(Config):
         self._id2name = {}
         """Dictionary with a mapping of id to fieldnames"""
 
+        self._prototypes = {}
+        """Prototypes of forms built from this configuration. See
+        :func:`formbar.form.get_prototype`"""
+
         self._initialized = False
         """Flag to indicate that the form has been setup"""
 
         self._buttons = self.get_buttons()
         """Buttons of the form"""
-        self._fields = self.init_fields()
+        self._pages = self._find_pages()
+        """Pages of the form"""
+        if compiled:
+            self._fields = self.init_compiled_fields()
+            self._conditionals = self._load_conditionals(
+                compiled["conditionals"])
+        else:
+            self._fields = self.init_fields()
+            self._conditionals = self._build_conditionals()
+        """Tuple with the names of the fields which are not in a
+        conditional and a tuple of conditionals in the form. Each
+        conditional is a tuple with the rule of the conditional, the
+        names of the fields directly in the conditional and the nested
+        conditionals."""
         self._initialized = True
         """Dictionary with all fields per page in a dictionary.
         {
@@ -391,6 +676,12 @@ class Form(Config):
         }
         """
 
+    def __setattr__(self, name, value):
+        if getattr(self, "_initialized", False):
+            raise AttributeError("Form configuration '%s' is read-only"
+                                 % self.id)
+        Config.__setattr__(self, name, value)
+
     def get_buttons(self, root=None):
         # Get all Buttons for the form.
         buttons = []
@@ -401,6 +692,13 @@ class Form(Config):
         return buttons
 
     def get_pages(self, root=None):
+        """Returns a list of the pages in the form or the given root
+        element."""
+        if root is None:
+            return list(self._pages)
+        return self._find_pages(root)
+
+    def _find_pages(self, root=None):
         # Get all fields for the form.
         pages = []
 
@@ -416,7 +714,7 @@ class Form(Config):
             sref = s.attrib.get('ref')
             if sref:
                 s = self._parent.get_element('snippet', sref)
-                pages.extend(self.get_pages(s))
+                pages.extend(self._find_pages(s))
         return pages
 
     def walk(self, root, values, evaluate=False, include_layout=False):
@@ -477,6 +775,87 @@ class Form(Config):
             elif child.tag == "field":
                 yield child
 
+    def _build_conditionals(self):
+        fields = set()
+        conditionals = []
+        pages = self.get_pages()
+        if len(pages) == 0:
+            pages.append(self._tree)
+        for page in pages:
+            self._collect_conditionals(page, fields, conditionals)
+        return frozenset(fields), tuple(conditionals)
+
+    def _collect_conditionals(self, root, fields, conditionals):
+        # Must follow the same path through the form as walk.
+        for child in root:
+            if len(child) > 0:
+                if child.tag == "if":
+                    rule = _get_conditional_rule(child.attrib.get('expr'))
+                    cfields = set()
+                    cconditionals = []
+                    self._collect_conditionals(child, cfields, cconditionals)
+                    conditionals.append((rule, frozenset(cfields),
+                                         tuple(cconditionals)))
+                else:
+                    self._collect_conditionals(child, fields, conditionals)
+            elif child.tag == "snippet":
+                sref = child.attrib.get('ref')
+                if sref:
+                    snippet = self._parent.get_element('snippet', sref)
+                    self._collect_conditionals(snippet, fields, conditionals)
+            elif child.tag == "field":
+                fields.add(self._id2name[child.attrib.get('ref')])
+
+    def _load_conditionals(self, compiled):
+        """Returns the conditionals of the form like
+        :meth:`_build_conditionals` for the compiled conditionals of a
+        bundle. See :meth:`dump_conditionals`."""
+        def load(conditionals):
+            return tuple((_get_conditional_rule(expr), frozenset(fields),
+                          load(nested))
+                         for expr, fields, nested in conditionals)
+        fields, conditionals = compiled
+        return frozenset(fields), load(conditionals)
+
+    def dump_conditionals(self):
+        """Returns the conditionals of the form with the expressions of
+        the rules instead of the rules, so they can be stored in a
+        bundle."""
+        def dump(conditionals):
+            return tuple((rule and rule._expression, sorted(fields),
+                          dump(nested))
+                         for rule, fields, nested in conditionals)
+        fields, conditionals = self._conditionals
+        return sorted(fields), dump(conditionals)
+
+    def get_active_fieldnames(self, values):
+        """Returns a set with the names of the fields in the form which
+        are active. A field is active if it is not in a conditional or
+        if all conditionals around the field evaluate to true using the
+        given values. Only the conditionals are evaluated.
+
+        :values: Dictionary with values which are used for evaluating
+        conditionals.
+        :returns: Set of fieldnames
+        """
+        fields, conditionals = self._conditionals
+        active = set(fields)
+        stack = list(conditionals)
+        while stack:
+            rule, fields, conditionals = stack.pop()
+            if rule is None:
+                continue
+            try:
+                if not rule.evaluate(values):
+                    continue
+            except TypeError:
+                # See walk. The rule refers to values which are not
+                # contained in the values.
+                continue
+            active.update(fields)
+            stack.extend(conditionals)
+        return active
+
     def init_fields(self, values=None, evaluate=False):
         """Will return the fields in the form as a dictionary. The
         dicionary will containe all fields per page to make the access
@@ -507,12 +886,38 @@ class Form(Config):
             for node in self.walk(page, values, evaluate):
                 ref = node.attrib.get('ref')
                 entity = self._parent.get_element('entity', ref)
+                if entity is None:
+                    err = ('Entity "%s" referenced in form "%s" (line %s) '
+                           'can not be found'
+                           % (ref, self.id, etree.sourceline(node)))
+                    log.error(err)
+                    raise ValueError(err)
                 field = Field(entity)
                 # Inherit readonly flag to all fields in this field.
                 if self.readonly:
                     field.readonly = self.readonly
                 per_page[field.name] = field
-                self._id2name[ref] = field.name
+                if not self._initialized:
+                    self._id2name[ref] = field.name
+        return fields
+
+    def init_compiled_fields(self):
+        """Will return the fields in the form as a dictionary like
+        :meth:`init_fields` but uses the precompiled list of referenced
+        entities per page instead of walking the form."""
+        fields = {}
+        for page_id, refs in self._compiled["pages"]:
+            per_page = {}
+            fields[page_id] = per_page
+            for ref in refs:
+                entity = self._parent.get_element('entity', ref)
+                compiled = self._parent.get_compiled_entity(
+                    entity.attrib.get('id'))
+                field = Field(entity, compiled)
+                if self.readonly:
+                    field.readonly = self.readonly
+                per_page[field.name] = field
+        self._id2name.update(self._compiled["id2name"])
         return fields
 
     def get_fields(self, root=None, values={}, evaluate=False):
@@ -524,8 +929,6 @@ class Form(Config):
 
         # TODO: Move filtering (evaluation) out of this method ()
         # <2016-01-11 15:33>
-        if not self._initialized:
-            self._fields = self.init_fields(values)
         fields = flatten_form_fields(self._fields, root)
         if evaluate:
             fields = filter_form_fields(self, fields, values)
@@ -551,13 +954,18 @@ class Form(Config):
 class Field(Config):
     """Configuration of a Field"""
 
-    def __init__(self, entity):
+    def __init__(self, entity, compiled=None):
         """Inits a field with the entity DOM element.
 
         :entity: entity DOM element
+        :compiled: Optional dictionary with the precompiled rules and
+        validators of the entity.
 
         """
-        Config.__init__(self, entity)
+        Config.__init__(self, entity, compiled)
+        self._rules = None
+        self._value_expression = None
+        self._filtered_options = {}
 
         # Attributes of the field
         self.id = entity.attrib.get('id')
@@ -662,36 +1070,113 @@ class Field(Config):
 
     def required_rule(self, rules):
         if self.required:
-            expr = "bool($%s)" % self.name
-            mode = "pre"
-            rule = Rule(expr, required_msg, mode)
-            rules.append(rule)
+            rules.append(BoolRule(self.name, required_msg, "pre"))
 
     def desired_rule(self, rules):
         if self.desired:
-            expr = "bool($%s)" % self.name
-            mode = "pre"
-            triggers = "warning"
-            rule = Rule(expr, desired_msg, mode, triggers)
-            rules.append(rule)
+            rules.append(BoolRule(self.name, desired_msg, "pre", "warning"))
 
     def get_rules(self):
-        rules = []
-        # Add automatic genertated rules based on the required or
-        # desired flag
-        self.required_rule(rules)
-        self.desired_rule(rules)
-
-        # Add rules added the the field.
+        """Returns a list of the rules of the field. The rules are only
+        built once per field configuration."""
+        if self._rules is None:
+            rules = []
+            # Add automatic genertated rules based on the required or
+            # desired flag
+            self.required_rule(rules)
+            self.desired_rule(rules)
+
+            # Add natively checked constraints of the field
+            for name, value, msg, triggers in self.get_constraint_specs():
+                if name == "options":
+                    value = [o[1] for o in self.options]
+                if msg is None:
+                    msg = constraint_msgs[name]
+                    if "%s" in msg:
+                        msg = msg % value
+                try:
+                    rule = constraint_rules[name](self.name, value,
+                                                  msg, triggers)
+                    rule.prepare(self.type)
+                except (ValueError, re.error) as ex:
+                    raise ValueError("Invalid %s constraint of '%s' in "
+                                     "line %s: %s"
+                                     % (name, self.name,
+                                        etree.sourceline(self._tree), ex))
+                rules.append(rule)
+
+            # Add rules added the the field.
+            for expr, msg, mode, triggers in self.get_rule_specs():
+                rules.append(Rule(expr, msg, mode, triggers))
+            self._rules = rules
+        return list(self._rules)
+
+    def get_rule_specs(self):
+        """Returns a list of tuples (expr, msg, mode, triggers) of the
+        rules configured for the field."""
+        if self._compiled:
+            return self._compiled["rules"]
+        specs = []
         for rule in self.get_elements('rule'):
-            expr = rule.attrib.get('expr')
-            msg = rule.attrib.get('msg')
-            mode = rule.attrib.get('mode')
-            triggers = rule.attrib.get('triggers')
-            rules.append(Rule(expr, msg, mode, triggers))
-        return rules
+            specs.append((rule.attrib.get('expr'),
+                          rule.attrib.get('msg'),
+                          rule.attrib.get('mode'),
+                          rule.attrib.get('triggers')))
+        return specs
+
+    def get_value_expression(self):
+        """Returns the expression of the default value of the field if
+        the value begins with '%' or None. The expression is only built
+        once per field configuration, so a compiled expression is reused
+        by all forms. See :func:`formbar.rules.enable_compiler`."""
+        if self._value_expression is None \
+           and self.value and self.value.startswith("%"):
+            self._value_expression = Expression(self.value.strip("%"))
+        return self._value_expression
+
+    def get_constraint_specs(self):
+        """Returns a list of tuples (name, value, msg, triggers) of the
+        constraints of the field. Constraints are defined either as
+        attribute of the entity (minlength, maxlength, min, max and
+        pattern) or as constraint element. The "options" constraint
+        checks the value against the options of the field and has no
+        value."""
+        if self._compiled and "constraints" in self._compiled:
+            return self._compiled["constraints"]
+        specs = []
+        for name in constraint_attributes:
+            value = self._tree.attrib.get(name)
+            if value is not None:
+                specs.append((name, value, None, None))
+        for constraint in self.get_elements('constraint'):
+            name = constraint.attrib.get('type')
+            if name not in constraint_rules:
+                raise ValueError("Unknown constraint '%s' in line %s"
+                                 % (name, etree.sourceline(constraint)))
+            if name == "options" and not isinstance(self.options, list):
+                log.warning("Ignoring options constraint of '%s'. The "
+                            "options are not static" % self.name)
+                continue
+            specs.append((name,
+                          constraint.attrib.get('value'),
+                          constraint.attrib.get('msg'),
+                          constraint.attrib.get('triggers')))
+        return specs
+
+    def get_html_constraints(self):
+        """Returns a list of tuples (attribute, value) of the constraints
+        of the field which can be checked by the browser using HTML5
+        attributes."""
+        attributes = []
+        for name, value, msg, triggers in self.get_constraint_specs():
+            if name in ("minlength", "maxlength", "pattern") \
+               and triggers != "warning":
+                attributes.append((name, value))
+        return attributes
 
     def get_validators(self):
+        if self._compiled:
+            return list(self._compiled["validators"])
         validators = []
         for validator in self.get_elements('validator'):
             # Import dynamically the validator
@@ -772,7 +1257,7 @@ class Renderer(Config):
         """The body attribute is currently only used by the HTML
         Renderer and has the content to be rendererd."""
         if self.render_type == "html" and len(entity) > 0:
-            self.body = ET.tostring(entity[0], method="html")
+            self.body = etree.tostring(entity[0], method="html")
 
     def __getattr__(self, name):
         return self._tree.attrib.get(name)
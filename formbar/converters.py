@@ -7,7 +7,6 @@ value into a string are named `from_<datatype>`."""
 import logging
 import datetime
 import re
-from babel.dates import format_datetime, format_date
 from datetime import timedelta
 from formbar.helpers import get_local_datetime, get_utc_datetime
 from formbar.fields import TimeField, TimedeltaField, DateTimeField, DateField
@@ -18,6 +17,20 @@ log = logging.getLogger(__name__)
 _ = lambda x: x
 
 
+def format_datetime(*args, **kwargs):
+    """Wrapper for :func:`babel.dates.format_datetime`. Babel is only
+    imported when the function is called the first time."""
+    from babel.dates import format_datetime
+    return format_datetime(*args, **kwargs)
+
+
+def format_date(*args, **kwargs):
+    """Wrapper for :func:`babel.dates.format_date`. Babel is only
+    imported when the function is called the first time."""
+    from babel.dates import format_date
+    return format_date(*args, **kwargs)
+
+
 class DeserializeException(Exception):
     """Exception for errors on deserialization."""
     def __init__(self, msg, value):
@@ -170,16 +183,63 @@ def to_manytomany(clazz, ids, db, selected):
 
     # Determine which items need to be added or removed from the
     # relation.
-    ids = set(ids)
-    add_ids = ids.difference(selected_ids)
+    add_ids = []
+    seen = set(selected_ids)
+    for id in ids:
+        if id not in seen:
+            seen.add(id)
+            add_ids.append(id)
     delete_ids = selected_ids.difference(ids)
 
     related_items = filter(lambda x: x.id not in delete_ids, selected)
-    for id in add_ids:
-        related_items.append(db.query(clazz).filter(clazz.id == id).one())
+    related_items.extend(load_items(clazz, add_ids, db))
     return related_items
 
 
+load_items_chunksize = 500
+"""Maximum number of ids in the IN clause of the queries of
+:func:`load_items`. SQLite supports at most 999 parameters per
+query."""
+
+
+def load_items(clazz, ids, db):
+    """Returns the items of the given class with the given ids in the
+    order of the ids. Items which are already loaded in the session are
+    taken from the identity map of the session unless they are deleted
+    in the session. All other items are loaded with one query per
+    ``load_items_chunksize`` ids. Raises a NoResultFound exception if one
+    of the items does not exist.
+
+    :clazz: SQLAlchemy mapped class
+    :ids: List of ids
+    :db: Database session
+    :returns: List of items
+    """
+    import sqlalchemy as sa
+    from sqlalchemy.orm.exc import NoResultFound
+    items = {}
+    missing = []
+    for id in ids:
+        item = db.identity_map.get(sa.orm.util.identity_key(clazz, id))
+        # Deleted items are queried again which flushes the deletion
+        # if autoflush is enabled.
+        if item is not None and item not in db.deleted \
+                and not sa.inspect(item).deleted:
+            items[id] = item
+        else:
+            missing.append(id)
+    for start in range(0, len(missing), load_items_chunksize):
+        chunk = missing[start:start + load_items_chunksize]
+        for item in db.query(clazz).filter(clazz.id.in_(chunk)):
+            items[item.id] = item
+    not_found = [id for id in ids if id not in items]
+    if not_found:
+        raise NoResultFound("No %s found with id %s"
+                            % (clazz.__name__,
+                               ", ".join(map(str, not_found))))
+    return [items[id] for id in ids]
+
+
 def to_onetomany(clazz, ids, db, selected):
     return to_manytomany(clazz, ids, db, selected)
 
@@ -0,0 +1,170 @@
+"""Parser backends for form configurations.
+
+Form configurations are parsed using `lxml <http://lxml.de>`_ if it is
+installed. lxml parses considerably faster, provides native access to
+the parent of an element, the line number of elements in the source
+file and compiled XPath expressions. If lxml is not available the
+ElementTree implementation of the standard library is used.
+
+The backend can be selected explicitly by setting the environment
+variable ``FORMBAR_XML_BACKEND`` to ``lxml`` or ``stdlib`` or by calling
+:func:`use`. The functions of this module work with elements of both
+backends.
+"""
+from __future__ import absolute_import
+import os
+import logging
+import xml.etree.ElementTree as _stdlib
+
+try:
+    from lxml import etree as _lxml
+    _parser = _lxml.XMLParser(remove_comments=True, remove_pis=True)
+    _find_by_id = _lxml.XPath(".//*[@id=$id]")
+except ImportError:
+    _lxml = None
+
+log = logging.getLogger(__name__)
+
+STDLIB = "stdlib"
+LXML = "lxml"
+
+backend = None
+"""Name of the backend used to parse form configurations"""
+
+
+def use(name=None):
+    """Sets the backend used to parse form configurations. If no name
+    is given lxml is used if it is installed.
+
+    :name: Name of the backend. Either "lxml" or "stdlib"
+    """
+    global backend
+    if name is None:
+        name = LXML if _lxml is not None else STDLIB
+    if name == LXML:
+        if _lxml is None:
+            raise ValueError("Backend 'lxml' is not available. "
+                             "Please install lxml")
+    elif name != STDLIB:
+        raise ValueError("Unknown backend '%s'" % name)
+    log.debug("Using '%s' backend for form configurations" % name)
+    backend = name
+
+
+def _is_lxml(element):
+    return _lxml is not None and isinstance(element, _lxml._Element)
+
+
+def fromstring(xml):
+    """Returns the root element of the parsed XML string.
+
+    :xml: XML string to be parsed
+    :returns: Element
+    """
+    if backend == LXML:
+        return _lxml.fromstring(xml, _parser)
+    return _stdlib.fromstring(xml)
+
+
+def parse(fileobj):
+    """Returns the root element of the XML parsed from the given file
+    like object.
+
+    :fileobj: File like object
+    :returns: Element
+    """
+    if backend == LXML:
+        return _lxml.parse(fileobj, _parser).getroot()
+    return _stdlib.parse(fileobj).getroot()
+
+
+def tostring(element, **kwargs):
+    """Returns the serialized element. Accepts the same keyword
+    arguments as :func:`xml.etree.ElementTree.tostring`.
+
+    :element: Element
+    :returns: String
+    """
+    if _is_lxml(element):
+        return _lxml.tostring(element, **kwargs)
+    return _stdlib.tostring(element, **kwargs)
+
+
+def iselement(node):
+    """Returns True if the node is an element. Comments and processing
+    instructions are not considered to be elements.
+
+    :node: Node of the tree
+    :returns: True or False
+    """
+    return isinstance(getattr(node, "tag", None), basestring)
+
+
+def index(parent, element):
+    """Returns the position of element in the children of parent.
+
+    :parent: Parent element
+    :element: Child element
+    :returns: Integer
+    """
+    if _is_lxml(parent):
+        return parent.index(element)
+    return list(parent).index(element)
+
+
+def replace(parent, index, element, new):
+    """Replaces the child element at the given index of parent with
+    the new element.
+
+    :parent: Parent element
+    :index: Position of element in parent
+    :element: Child element which will be replaced
+    :new: New element
+    """
+    if _is_lxml(parent):
+        parent.replace(element, new)
+    else:
+        parent[index] = new
+
+
+def getparent(tree):
+    """Returns a function which returns the parent of an element in the
+    given tree. lxml provides the parent of an element natively. For
+    the stdlib backend a map of all elements in the tree to their parent
+    is built. The map is not updated if the tree is modified.
+
+    :tree: Root element
+    :returns: Function
+    """
+    if _is_lxml(tree):
+        return lambda element: element.getparent()
+    parent_map = {c: p for p in tree.iter() for c in p}
+    return parent_map.get
+
+
+def sourceline(element):
+    """Returns the line number of the element in the parsed file or None
+    if the line number is not available.
+
+    :element: Element
+    :returns: Integer or None
+    """
+    return getattr(element, "sourceline", None)
+
+
+def find_by_id(tree, id):
+    """Returns the first element below tree with the given id or None.
+
+    :tree: Root element
+    :id: ID of the element
+    :returns: Element or None
+    """
+    if _is_lxml(tree):
+        result = _find_by_id(tree, id=id)
+        if result:
+            return result[0]
+        return None
+    return tree.find(".//*[@id='%s']" % id)
+
+
+use(os.environ.get("FORMBAR_XML_BACKEND") or None)
@@ -3,22 +3,106 @@
 import logging
 import datetime
 import re
-import sqlalchemy as sa
-from formbar.rules import Rule, Expression
+import itertools
+import threading
+from formbar.rules import Rule
+from formbar.options import option_cache
 import formbar.config as config
 
 log = logging.getLogger(__name__)
 
 
 def rules_to_string(field):
-    return [u"{}".format(r) for r in field.get_rules()]
+    # Constraints without an equivalent expression are only checked on
+    # the server.
+    return [u"{}".format(r) for r in field.get_rules()
+            if r._expression is not None]
+
+
+class PropertyCache(object):
+    """Cache of the properties of SQLAlchemy mapped classes. The
+    properties of a class are mapped by their name on first access
+    together with their formbar datatype and the related class of
+    relations. The cache is cleared whenever SQLAlchemy configures
+    mappers as this may change the properties of classes."""
+
+    def __init__(self):
+        self._classes = {}
+        self._types = {}
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def _listen(self):
+        import sqlalchemy as sa
+        with self._lock:
+            if not self._listening:
+                sa.event.listen(sa.orm.mapper, "after_configured", self.clear)
+                self._listening = True
+
+    def _get_properties(self, clazz):
+        properties = self._classes.get(clazz)
+        if properties is None:
+            import sqlalchemy as sa
+            if not self._listening:
+                self._listen()
+            mapper = sa.orm.class_mapper(clazz)
+            properties = dict((prop.key, prop)
+                              for prop in mapper.iterate_properties)
+            with self._lock:
+                self._classes[clazz] = properties
+        return properties
+
+    def get_property(self, clazz, name):
+        """Returns the property with the given name of the mapped class
+        or None if the class has no such property.
+
+        :clazz: SQLAlchemy mapped class
+        :name: Name of the property
+        :returns: Property or None
+        """
+        return self._get_properties(clazz).get(name)
+
+    def get_type(self, sa_property):
+        """Returns the formbar datatype of the given property. See
+        :func:`get_type_from_sa_property`.
+
+        :sa_property: Property of a mapped class
+        :returns: Name of the datatype
+        """
+        dtype = self._types.get(sa_property)
+        if dtype is None:
+            dtype = get_type_from_sa_property(sa_property)
+            with self._lock:
+                self._types[sa_property] = dtype
+        return dtype
+
+    def get_related_class(self, clazz, name):
+        """Returns the class related to the mapped class by the
+        relation with the given name or None if there is no such
+        relation.
+
+        :clazz: SQLAlchemy mapped class
+        :name: Name of the relation
+        :returns: Class or None
+        """
+        prop = self.get_property(clazz, name)
+        try:
+            return prop.mapper.class_
+        except AttributeError:
+            return None
+
+    def clear(self):
+        """Removes all classes from the cache."""
+        with self._lock:
+            self._classes.clear()
+            self._types.clear()
+
+property_cache = PropertyCache()
+"""Process wide cache of the properties of mapped classes"""
 
 
 def get_sa_property(item, name):
-    mapper = sa.orm.object_mapper(item)
-    for prop in mapper.iterate_properties:
-        if prop.key == name:
-            return prop
+    return property_cache.get_property(type(item), name)
 
 
 def get_type_from_sa_property(sa_property):
@@ -53,13 +137,57 @@ class FieldFactory(object):
         """
         self.form = form
         self.translate = translate
+        self._builders = {
+            "string": self._create_string,
+            "integer": self._create_integer,
+            "float": self._create_float,
+            "date": self._create_date,
+            "datetime": self._create_datetime,
+            "interval": self._create_timedelta,
+            "time": self._create_time,
+            "file": self._create_file,
+            "boolean": self._create_boolean,
+            "email": self._create_email,
+            "integerselection": self._create_intselection,
+            "stringselection": self._create_stringselection,
+            "booleanselection": self._create_booleanselection,
+            "multiselection": self._create_multiselection,
+            "manytoone": self._create_manytoone,
+            "onetoone": self._create_onetoone,
+            "onetomany": self._create_onetomany,
+            "manytomany": self._create_manytomany,
+        }
 
-    def create(self, fieldconfig):
+    def create(self, fieldconfig, sa_property=None, dtype=None):
         """Will return a Field instance based on the given field config.
 
         :fieldconfig: Reference to the ::class::Field config instance
+        :sa_property: SQLAlchemy property of the field. Only used if
+        dtype is given.
+        :dtype: Datatype of the field as returned by :meth:`get_type`.
+        If not given the datatype is determined for the field.
         :returns: Field instance
 
+        """
+        if dtype is None:
+            if self.form._item:
+                sa_property = get_sa_property(self.form._item,
+                                              fieldconfig.name)
+            else:
+                sa_property = None
+            dtype = self.get_type(fieldconfig, sa_property)
+        builder = self._builders.get(dtype, self._create_default)
+        return builder(fieldconfig, sa_property)
+
+    def get_type(self, fieldconfig, sa_property=None):
+        """Returns the datatype of the field which is used to choose the
+        class of the field.
+
+        :fieldconfig: Reference to the ::class::Field config instance
+        :sa_property: SQLAlchemy property of the field in the mapped
+        item of the form.
+        :returns: Name of the datatype
+
         """
         # If the form has a mapped item, then try to determine the type
         # of the field by looking on the property. This type is used for
@@ -67,14 +195,9 @@ class FieldFactory(object):
         # 1. As fallback if the form does not define type.
         # 2. For integrity checks to show that there is a missmatch
         # between type configuration in a form and the SQLALCHEMY model.
-        if self.form._item:
-            sa_property = get_sa_property(self.form._item, fieldconfig.name)
-            if sa_property:
-                sa_dtype = get_type_from_sa_property(sa_property)
-            else:
-                sa_dtype = None
+        if sa_property:
+            sa_dtype = property_cache.get_type(sa_property)
         else:
-            sa_property = None
             sa_dtype = None
 
         # Set datatype of the field based on the config, the type in the
@@ -98,27 +221,6 @@ class FieldFactory(object):
         log.debug("Creating field '{name}' with datatype '{dtype}'"
                   "".format(name=fieldconfig.name, dtype=dtype))
 
-        builder_map = {
-            "string": self._create_string,
-            "integer": self._create_integer,
-            "float": self._create_float,
-            "date": self._create_date,
-            "datetime": self._create_datetime,
-            "interval": self._create_timedelta,
-            "time": self._create_time,
-            "file": self._create_file,
-            "boolean": self._create_boolean,
-            "email": self._create_email,
-            "integerselection": self._create_intselection,
-            "stringselection": self._create_stringselection,
-            "booleanselection": self._create_booleanselection,
-            "multiselection": self._create_multiselection,
-            "manytoone": self._create_manytoone,
-            "onetoone": self._create_onetoone,
-            "onetomany": self._create_onetomany,
-            "manytomany": self._create_manytomany,
-        }
-
         # Look on the renderer to get further informations on the type
         # of the field.
         if dtype not in ["manytoone", "onetomany", "onetoone"] and \
@@ -129,9 +231,7 @@ class FieldFactory(object):
                 if dtype not in ("string", "integer"):
                     raise TypeError("Checkbox must be of type either string or integer!")
                 dtype = "multiselection"
-
-        builder = builder_map.get(dtype, self._create_default)
-        return builder(fieldconfig, sa_property)
+        return dtype
 
     def _create_string(self, fieldconfig, sa_property):
         return StringField(self.form, fieldconfig, self.translate, sa_property)
@@ -205,11 +305,10 @@ class Field(object):
         :config: Field configuration
 
         """
-        from formbar.renderer import get_renderer
         self._form = form
         self._config = config
         self._translate = translate
-        self.renderer = get_renderer(self, translate)
+        self._renderer = None
         self._sa_property = sa_property
 
         self.errors = []
@@ -225,8 +324,9 @@ class Field(object):
         # a brabbel expression and set the value of the default value to
         # the result of the evaluation of the expression.
         if value and value.startswith("%"):
-            form_values = self._form._get_data_from_item()
-            value = Expression(value.strip("%")).evaluate(values=form_values)
+            form_values = self._form._get_item_values()
+            value = self._config.get_value_expression().evaluate(
+                values=form_values)
         # If value begins with '$' then consider the string as attribute
         # name of the item in the form and get the value
         elif value and value.startswith("$"):
@@ -269,6 +369,19 @@ class Field(object):
     #     #_type = "type:\t\t{}".format(self.get_type())
     #     return "\n".join([field, required, desired, value, _type, rules])+"\n"
 
+    @property
+    def renderer(self):
+        """Renderer of the field. The renderer is created on first
+        access."""
+        if self._renderer is None:
+            from formbar.renderer import get_renderer
+            self._renderer = get_renderer(self, self._translate)
+        return self._renderer
+
+    @renderer.setter
+    def renderer(self, renderer):
+        self._renderer = renderer
+
     @property
     def rules_to_string(self):
         log.warning("Call of 'rules_to_string' property is deprecated. Use rules_to_string helper method.")
@@ -474,14 +587,18 @@ class CollectionField(Field):
     in the database please check ::class::RelationField."""
 
     def expand_value(self, value):
-        ex_values = []
         if not isinstance(value, list):
             value = [value]
-        options = self.get_options()
-        for opt in options:
-            for v in value:
-                if unicode(v) == unicode(opt[1]):
-                    ex_values.append("%s" % opt[0])
+        # Index of the labels of the options by the string of their
+        # value.
+        labels = {}
+        for opt in self.get_options():
+            labels.setdefault(unicode(opt[1]), opt[0])
+        ex_values = []
+        for v in value:
+            key = unicode(v)
+            if key in labels:
+                ex_values.append("%s" % labels[key])
         return ", ".join(ex_values)
 
     def get_previous_value(self, default=None, expand=False):
@@ -526,6 +643,11 @@ class CollectionField(Field):
         raise NotImplementedError()
 
     def _build_filter_rule(self, expr_str, item):
+        return Rule(self._substitute_filter(expr_str))
+
+    def _substitute_filter(self, expr_str):
+        """Returns the filter expression with the variables of the form,
+        the item and the user replaced by their current values."""
         t = expr_str.split(" ")
         # The filter expression may reference values of the form using $
         # variables. To have access to these values we extract the
@@ -584,7 +706,7 @@ class CollectionField(Field):
                     expr_str = expr_str.replace(x, "%s" % unicode(value))
                 else:
                     expr_str = expr_str.replace(x, "'%s'" % unicode(value))
-        return Rule(str(expr_str))
+        return str(expr_str)
 
     def filter_options(self, options):
         """Will return a of tuples with options. The given options can
@@ -596,7 +718,11 @@ class CollectionField(Field):
         :returns: List of tuples.
 
         """
-        filtered_options = []
+        return list(self._iter_filtered_options(options))
+
+    def _iter_filtered_options(self, options):
+        """Generator version of :meth:`filter_options`. Options are
+        only filtered when they are consumed."""
         if self._config.renderer and self._config.renderer.filter:
             rule = self._build_filter_rule(self._config.renderer.filter, None)
             x = re.compile("\$[\w\.]+")
@@ -623,25 +749,48 @@ class CollectionField(Field):
                     values[str(key)] = unicode(value)
                 result = rule.evaluate(values)
                 if result:
-                    filtered_options.append((o_label, o_value, True))
+                    yield (o_label, o_value, True)
                 else:
-                    filtered_options.append((o_label, o_value, False))
+                    yield (o_label, o_value, False)
             else:
-                filtered_options.append((o_label, o_value, True))
-        return filtered_options
+                yield (o_label, o_value, True)
 
 
 class SelectionField(CollectionField):
     """Field which can have one or more of predefined values. The
     values are defined in the fields config."""
 
+    options_maxsize = 64
+    """Maximum number of filtered option lists which are memoized per
+    field configuration."""
+
     def get_options(self):
         options = []
         user_defined_options = self._config.options
         if isinstance(user_defined_options, list) and \
            len(user_defined_options) > 0:
+            # The filtered and sorted options only depend on the options
+            # and the values in the substituted filter expression. They
+            # are memoized in the field configuration.
+            renderer = self._config.renderer
+            if renderer is None:
+                key = (None, None, None)
+            elif renderer.filter:
+                key = (self._substitute_filter(renderer.filter),
+                       renderer.sort, renderer.sortorder)
+            else:
+                key = (None, renderer.sort, renderer.sortorder)
+            memo = self._config._filtered_options
+            cached = memo.get(key)
+            if cached is not None and cached[0] is user_defined_options:
+                return list(cached[1])
             for option in self.filter_options(user_defined_options):
                 options.append((option[0], option[1], option[2]))
+            options = self.sort_options(options)
+            if len(memo) >= self.options_maxsize:
+                memo.clear()
+            memo[key] = (user_defined_options, options)
+            return list(options)
         elif isinstance(user_defined_options, str):
             for option in self._form.merged_data.get(user_defined_options):
                 options.append((option[0], option[1], True))
@@ -710,6 +859,10 @@ class RelationField(CollectionField):
     are defined through the relation in the database.  Please note that
     these require a SQLALCHEMY mapped item in the form!"""
 
+    option_cache = option_cache
+    """Cache of the options. See :mod:`formbar.options`. Set to None to
+    disable caching of options."""
+
     def __init__(self, form, config, translate, sa_property):
         if not form._dbsession:
             # For now we only log a warning. In the future we should be
@@ -737,15 +890,187 @@ class RelationField(CollectionField):
             return value
 
     def _get_sa_mapped_class(self):
-        sa_property = get_sa_property(self._form._item, self._config.name)
-        return sa_property.mapper.class_
+        return property_cache.get_related_class(type(self._form._item),
+                                                self._config.name)
+
+    def _get_option_attributes(self):
+        """Returns the names of the attributes of the options which are
+        used in the filter of the field."""
+        if self._config.renderer and self._config.renderer.filter:
+            return [key or "value" for key
+                    in re.findall(r"%(\w*)", self._config.renderer.filter)]
+        return []
+
+    def _get_filter_criterion(self, clazz):
+        """Returns the filter of the renderer translated into a
+        SQLAlchemy criterion or None if the field has no filter or the
+        filter can not be translated. See :mod:`formbar.filtercompiler`.
+        """
+        from formbar.filtercompiler import compile_filter
+        from formbar.rulecompiler import CompileError
+        if not (self._config.renderer and self._config.renderer.filter):
+            return None
+        rule = self._build_filter_rule(self._config.renderer.filter, None)
+        try:
+            return compile_filter(rule._expression_tree, clazz)
+        except CompileError as ex:
+            log.debug("Filter '%s' of '%s' is evaluated in Python: %s"
+                      % (rule._expression, self.name, ex))
+            return None
+
+    def _filter_options_in_db(self, clazz, criterion, options):
+        """Returns the tuples of the given options like
+        :meth:`filter_options`. The options passing the filter are
+        determined by querying their ids with the given criterion."""
+        query = self._form._dbsession.query(clazz.id).filter(criterion)
+        if self.is_searchable():
+            if not options:
+                return []
+            query = query.filter(clazz.id.in_([o.id for o in options]))
+        passed = set(id for id, in query)
+        return [(option, option.id, option.id in passed)
+                for option in options]
+
+    def is_searchable(self):
+        """Returns True if the options of the field are searched on the
+        server instead of being rendered completely. See
+        :meth:`search_options`."""
+        return bool(self._config.renderer and self._config.renderer.search)
+
+    def _get_label_column(self, clazz, attributes=()):
+        """Returns the name of the column with the label of the options
+        if the options can be loaded with a query of the columns only.
+        This requires the ``labelcolumn`` attribute of the renderer and
+        all given attributes to be columns of the class."""
+        label = self._config.renderer and self._config.renderer.labelcolumn
+        if not label:
+            return None
+        for name in [label] + list(attributes):
+            if not hasattr(property_cache.get_property(clazz, name),
+                           "columns"):
+                if name == label:
+                    log.warning("Label '%s' of the options of '%s' is no "
+                                "column" % (label, self.name))
+                return None
+        return label
+
+    def _get_options_query(self, clazz, attributes=()):
+        """Returns the query of the options of the field and a function
+        which converts the rows of the query into the options. If a
+        label column is configured only the needed columns are loaded
+        and the options are :class:`formbar.options.Option`. Otherwise
+        the options are the items of the class."""
+        from formbar.options import query_options, load_options
+        db = self._form._dbsession
+        label = self._get_label_column(clazz, attributes)
+        if label is None:
+            return db.query(clazz), lambda rows: rows
+        return (query_options(db, clazz, label, attributes),
+                lambda rows: load_options(rows, attributes))
+
+    def _get_selected_items(self, clazz, attributes=()):
+        from formbar.converters import to_integer_list
+        try:
+            ids = to_integer_list(self.get_value())
+        except (ValueError, TypeError):
+            return []
+        if not ids:
+            return []
+        query, convert = self._get_options_query(clazz, attributes)
+        items = convert(query.filter(clazz.id.in_(ids)))
+        order = dict((id, num) for num, id in enumerate(ids))
+        return sorted(items, key=lambda item: order.get(item.id))
+
+    def search_options(self, term, page=1):
+        """Returns a page of the options of the field whose search
+        attribute starts with the given term. The search attribute is
+        configured in the ``search`` attribute of the renderer. The
+        search is case insensitive. Options which do not pass the
+        filter of the renderer are not returned. The filter is applied
+        in the database if possible.
+
+        The result is a dictionary which can be returned directly as
+        JSON response::
+
+            {"page": 1, "more": True,
+             "options": [{"value": 1, "label": "Foo"}, ...]}
+
+        :term: Beginning of the search attribute of the options.
+        :page: Number of the page. The first page is 1. Invalid numbers
+               return the first page. The size of the page is
+               configured in the ``pagesize`` attribute of the renderer.
+               Defaults to 20.
+        :returns: Dictionary with the options of the page
+        """
+        renderer = self._config.renderer
+        pagesize = int(renderer.pagesize or 20)
+        try:
+            page = max(int(page or 1), 1)
+        except (ValueError, TypeError):
+            page = 1
+        offset = (page - 1) * pagesize
+        clazz = self._get_sa_mapped_class()
+        column = getattr(clazz, renderer.search)
+        criterion = self._get_filter_criterion(clazz)
+        if renderer.filter and criterion is None:
+            attributes = self._get_option_attributes()
+        else:
+            attributes = []
+        query, convert = self._get_options_query(clazz, attributes)
+        if term:
+            pattern = re.sub(r"([\\%_])", r"\\\1", term) + "%"
+            query = query.filter(column.ilike(pattern, escape="\\"))
+        query = query.order_by(column, clazz.id)
+        if criterion is not None:
+            query = query.filter(criterion)
+        if renderer.filter and criterion is None:
+            # The filter is evaluated on the options in Python. Only as
+            # many options are loaded as needed to fill the page.
+            options = (option for option
+                       in self._iter_filtered_options(convert(query))
+                       if option[2])
+            options = list(itertools.islice(options, offset,
+                                            offset + pagesize + 1))
+        else:
+            rows = query.offset(offset).limit(pagesize + 1)
+            options = [(item, item.id, True) for item in convert(rows)]
+        return {"page": page,
+                "more": len(options) > pagesize,
+                "options": [{"value": option[1],
+                             "label": unicode(option[0])}
+                            for option in options[:pagesize]]}
 
     def get_options(self):
+        """Returns the options of the field. If the options of the field
+        are searchable (See :meth:`is_searchable`) only the selected
+        options are returned."""
         options = []
         try:
             clazz = self._get_sa_mapped_class()
-            unfiltered = self._form._dbsession.query(clazz)
-            options.extend(self.filter_options(unfiltered))
+            criterion = self._get_filter_criterion(clazz)
+            # Attributes of the options are only needed if the filter is
+            # evaluated in Python.
+            if criterion is None:
+                attributes = self._get_option_attributes()
+            else:
+                attributes = []
+            if self.is_searchable():
+                unfiltered = self._get_selected_items(clazz, attributes)
+            else:
+                query, convert = self._get_options_query(clazz, attributes)
+                unfiltered = convert(query)
+            if self.option_cache is not None and \
+               not self.is_searchable() and \
+               self._config.renderer and \
+               self._config.renderer.cache == "true":
+                unfiltered = self.option_cache.get(
+                    clazz, attributes, unfiltered,
+                    label=self._get_label_column(clazz, attributes))
+            if criterion is None:
+                options.extend(self.filter_options(unfiltered))
+            else:
+                options.extend(self._filter_options_in_db(clazz, criterion,
+                                                          unfiltered))
         except:
             log.error("Failed to load options for '%s' "
                       "to load the option from db" % self.name)
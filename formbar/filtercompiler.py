@@ -0,0 +1,143 @@
+"""Translation of filter expressions into SQL.
+
+The options of relation fields can be filtered by an expression in the
+``filter`` attribute of the renderer. By default the expression is
+evaluated in Python for every option which requires loading all items of
+the related class. The compiler in this module translates the
+expression into a SQLAlchemy criterion, so the options can be filtered
+by the database instead.
+
+The filter is evaluated in Python on the string representation of the
+attributes of the options. The compiler translates:
+
+- comparisons of an attribute with a string using ``==`` and ``!=``,
+- ``in`` with a list of strings,
+- ``and``, ``or`` and ``not``.
+
+The attributes must be mapped columns of the related class with a
+string, integer or boolean type. The values of ``@``, ``$`` and
+``$user`` variables are already substituted in the expression and are
+handled like any other string. Expressions which can not be translated
+raise a :class:`formbar.rulecompiler.CompileError`. They are still
+evaluated in Python.
+
+Comparisons of integer and boolean columns give the same result as the
+Python filter on every backend. Comparisons of string columns are done
+with the collation of the database. They only give the same result if
+the collation compares strings exactly. With a case insensitive
+collation, e.g. the default collation of MySQL, or a collation which
+ignores trailing spaces the criterion can select more options than the
+Python filter.
+"""
+import re
+from pyparsing import ParseResults
+from formbar.rulecompiler import CompileError
+
+_integer = re.compile(r"-?(0|[1-9][0-9]*)\Z")
+
+
+def _get_column(clazz, element):
+    from formbar.fields import property_cache
+    if not (isinstance(element, str) and element.startswith("$")):
+        raise CompileError("'%s' is not an attribute" % element)
+    name = element.strip("$")
+    prop = property_cache.get_property(clazz, name)
+    if not hasattr(prop, "columns") or len(prop.columns) != 1:
+        raise CompileError("'%s' is not a column" % name)
+    try:
+        python_type = prop.columns[0].type.python_type
+    except NotImplementedError:
+        raise CompileError("Unknown type of column '%s'" % name)
+    return getattr(clazz, name), python_type
+
+
+def _convert(value, python_type):
+    """Returns the value of the column which has the given string
+    representation or raises a CompileError if there is no such
+    value."""
+    if not isinstance(value, basestring) or value == u"None" \
+            or (isinstance(value, str) and value.startswith("$")):
+        raise CompileError("Can not compare with '%s'" % value)
+    if issubclass(python_type, basestring):
+        return value
+    elif issubclass(python_type, bool):
+        if value in (u"True", u"False"):
+            return value == u"True"
+    elif issubclass(python_type, (int, long)):
+        if _integer.match(value):
+            return int(value)
+    else:
+        raise CompileError("Can not compare with type %s" % python_type)
+    raise CompileError("'%s' is no value of type %s" % (value, python_type))
+
+
+def _comparison(clazz, left, op, right):
+    import sqlalchemy as sa
+    if op in ("==", "!=") and not isinstance(left, str):
+        left, right = right, left
+    column, python_type = _get_column(clazz, left)
+    # NULL values are represented as 'None' in Python. The criteria
+    # must never be NULL to give the same result in negations.
+    if op == "==":
+        return sa.and_(column.isnot(None),
+                       column == _convert(right, python_type))
+    elif op == "!=":
+        return sa.or_(column.is_(None),
+                      column != _convert(right, python_type))
+    elif op == "in" and isinstance(right, list):
+        values = []
+        for value in right:
+            if value == u"None" or isinstance(value, str):
+                raise CompileError("Can not compare with '%s'" % value)
+            try:
+                values.append(_convert(value, python_type))
+            except CompileError:
+                # The value is not equal to any value of the column.
+                pass
+        if not values:
+            raise CompileError("No comparable values in '%s'" % right)
+        return sa.and_(column.isnot(None), column.in_(values))
+    raise CompileError("Operator '%s' is not supported" % op)
+
+
+def _compile(tree, clazz):
+    import sqlalchemy as sa
+    elements = list(tree)
+    if len(elements) == 1 and isinstance(elements[0], ParseResults):
+        return _compile(elements[0], clazz)
+    if len(elements) == 2 and elements[0] == "not":
+        if not isinstance(elements[1], ParseResults):
+            raise CompileError("'not' is only supported for terms")
+        return sa.not_(_compile(elements[1], clazz))
+    if len(elements) == 3 and not isinstance(elements[0], ParseResults) \
+            and not isinstance(elements[2], ParseResults):
+        return _comparison(clazz, *elements)
+    if len(elements) >= 3 and len(elements) % 2 == 1:
+        ops = set(elements[1::2])
+        if ops == set(["and"]):
+            return sa.and_(*[_compile_term(e, clazz)
+                             for e in elements[0::2]])
+        elif ops == set(["or"]):
+            return sa.or_(*[_compile_term(e, clazz)
+                            for e in elements[0::2]])
+    raise CompileError("Expression is not supported")
+
+
+def _compile_term(element, clazz):
+    if not isinstance(element, ParseResults):
+        raise CompileError("'%s' is no term" % element)
+    return _compile(element, clazz)
+
+
+def compile_filter(tree, clazz):
+    """Returns a SQLAlchemy criterion for the given parsed filter
+    expression. The criterion selects the items of the class for which
+    the filter expression evaluates to True.
+
+    :tree: Parsed expression tree of the filter
+    :clazz: SQLAlchemy mapped class of the options
+    :returns: SQLAlchemy criterion
+    """
+    if tree is None:
+        raise CompileError("Expression can not be parsed")
+    return _compile(tree, clazz)
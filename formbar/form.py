@@ -1,9 +1,9 @@
 import logging
 import importlib
 import inspect
-import sqlalchemy as sa
+import threading
 from formbar.renderer import FormRenderer
-from formbar.fields import FieldFactory
+from formbar.fields import FieldFactory, property_cache
 from formbar.converters import (
     DeserializeException, from_python, to_python
 )
@@ -23,10 +23,7 @@ def get_sa_property(item, fieldname):
         return get_sa_property(getattr(item, ".".join(nameparts[0:-1])),
                                nameparts[-1])
     else:
-        mapper = sa.orm.object_mapper(item)
-        for prop in mapper.iterate_properties:
-            if prop.key == fieldname:
-                return prop
+        return property_cache.get_property(type(item), fieldname)
 
 
 def remove_ws(data):
@@ -45,12 +42,14 @@ def remove_ws(data):
 
 
 def get_attributes(cls):
+    import sqlalchemy as sa
     return [prop.key for prop in sa.orm.class_mapper(cls).iterate_properties
             if isinstance(prop, sa.orm.ColumnProperty)
             or isinstance(prop, sa.orm.RelationshipProperty)]
 
 
 def get_relations(cls):
+    import sqlalchemy as sa
     return [prop.key for prop in sa.orm.class_mapper(cls).iterate_properties
             if isinstance(prop, sa.orm.RelationshipProperty)]
 
@@ -116,6 +115,109 @@ class Validator(object):
             return False
 
 
+class FormPrototype(object):
+    """Prototype for forms of the same form configuration. The prototype
+    determines the class, datatype and SQLAlchemy property of every
+    field once. Forms created by the prototype only create the field
+    instances holding the values, errors and warnings of the request.
+    Renderers of the fields are created on first use::
+
+        prototype = get_prototype(form_config, item_class=User)
+        form = prototype.create(item, dbsession, translate)
+    """
+
+    def __init__(self, config, item_class=None, locale=None,
+                 renderers=None):
+        """
+        :config: Form configuration. Should be a shared configuration
+                 as returned by :meth:`.Config.get_form`.
+        :item_class: SQLAlchemy mapped class of the items of the form.
+        :locale: Default locale of the created forms.
+        :renderers: Dictionary of custom renderers. See :class:`Form`.
+        """
+        self.config = config
+        self.item_class = item_class
+        self.locale = locale
+        self.renderers = renderers or {}
+        self.fields = self._prepare_fields()
+        """List of tuples (name, fieldconfig, sa_property, dtype) of
+        the fields in the form"""
+
+    def _prepare_fields(self):
+        factory = FieldFactory(None, None)
+        fields = []
+        for name, field in self.config.get_fields().iteritems():
+            sa_property = None
+            if self.item_class is not None:
+                if "." in field.name:
+                    # The property of dotted names depends on the
+                    # related items of the item. The type of the field
+                    # is determined when the form is created.
+                    fields.append((name, field, None, None))
+                    continue
+                sa_property = property_cache.get_property(self.item_class,
+                                                          field.name)
+            dtype = factory.get_type(field, sa_property)
+            fields.append((name, field, sa_property, dtype))
+        return fields
+
+    def create(self, item=None, dbsession=None, translate=None, **kwargs):
+        """Returns a new :class:`Form` for the given item. Accepts the
+        same arguments as :class:`Form`.
+
+        The fields of the form are the same as the fields of a
+        :class:`Form` created directly. If the form has no item or the
+        item is an instance of a subclass of the item class, the form is
+        created by the prototype of the class of the item.
+
+        :item: SQLAlchemy mapped instance of the item class of the
+               prototype.
+        :dbsession: dbsession
+        :translate: Translation function
+        :returns: :class:`Form`
+        """
+        if item is not None:
+            if self.item_class is None:
+                raise TypeError("Prototype without item class can not "
+                                "create forms for items")
+            if not isinstance(item, self.item_class):
+                raise TypeError("Item must be an instance of %s"
+                                % self.item_class.__name__)
+        item_class = type(item) if item is not None else None
+        if item_class is not self.item_class:
+            prototype = get_prototype(self.config, item_class, self.locale,
+                                      self.renderers)
+            return prototype.create(item, dbsession, translate, **kwargs)
+        kwargs.setdefault("renderers", self.renderers)
+        kwargs.setdefault("locale", self.locale)
+        return Form(self.config, item, dbsession, translate,
+                    prototype=self, **kwargs)
+
+
+_prototypes_lock = threading.Lock()
+
+
+def get_prototype(config, item_class=None, locale=None, renderers=None):
+    """Returns the :class:`FormPrototype` for the given form
+    configuration, item class, locale and custom renderers. The
+    prototype is only built once and stored in the configuration.
+
+    :config: Form configuration as returned by :meth:`.Config.get_form`
+    :item_class: SQLAlchemy mapped class of the items of the form.
+    :locale: Default locale of the created forms.
+    :renderers: Dictionary of custom renderers.
+    :returns: :class:`FormPrototype`
+    """
+    key = (item_class, locale,
+           tuple(sorted((renderers or {}).items())))
+    with _prototypes_lock:
+        prototype = config._prototypes.get(key)
+        if prototype is None:
+            prototype = FormPrototype(config, item_class, locale, renderers)
+            config._prototypes[key] = prototype
+    return prototype
+
+
 class Form(object):
     """Class for forms. The form will take care for rendering the form,
     validating the submitted data and saving the data back to the
@@ -135,7 +237,7 @@ class Form(object):
     def __init__(self, config, item=None, dbsession=None, translate=None,
                  change_page_callback={}, renderers={}, request=None,
                  csrf_token=None, eval_url=None, url_prefix="", locale=None,
-                 values=None):
+                 values=None, prototype=None, search_url=None):
         """Initialize the form with ``Form`` configuration instance and
         optional an SQLAlchemy mapped object.
 
@@ -166,16 +268,30 @@ class Form(object):
         display of the date and number functions.
         :values: Dictionary with values to be prefilled/overwritten in
                  the rendered form.
+        :prototype: :class:`FormPrototype` of the form. If given the
+                    fields are created from the prepared fields of the
+                    prototype. Usually forms with a prototype are
+                    created by calling :meth:`FormPrototype.create`.
+        :search_url: External URL to search the options of relation
+                     fields with a searching renderer. The name of the
+                     field, the search term and the page are provided in
+                     the "field", "term" and "page" parameters of a GET
+                     request. The return value is the JSON result of
+                     :meth:`formbar.fields.RelationField.search_options`.
         """
         self._config = config
+        self._prototype = prototype
         self._item = item
         self._dbsession = dbsession
         self._request = request
         self._csrf_token = csrf_token
         self._url_prefix = url_prefix
         self._eval_url = eval_url
+        self._search_url = search_url
         if self._url_prefix:
             self._eval_url = self._url_prefix + self._eval_url
+            if self._search_url:
+                self._search_url = self._url_prefix + self._search_url
 
         if locale:
             self._locale = locale
@@ -210,6 +326,7 @@ class Form(object):
         """
         self.external_renderers = renderers
         """Dictionary with external provided custom renderers."""
+        self._item_values = None
         self.fields = self._build_fields()
         """Dictionary with fields."""
         self.data = {}
@@ -219,7 +336,7 @@ class Form(object):
         self.submitted_data = {}
         """The submitted data from the user. If validation fails, then
         this values are used to rerender the form."""
-        self.loaded_data = self._get_data_from_item()
+        self.loaded_data = self._get_item_values()
         """This is the initial data loaded from the given item. Used to
         render the readonly forms"""
         if not values:
@@ -255,6 +372,14 @@ class Form(object):
                 field = self.fields[key]
                 field.set_previous_value(value)
 
+    def _get_item_values(self):
+        """Returns the values of the fields loaded from the item. The
+        values are only loaded once per form and shared by the default
+        values of all fields and :attr:`loaded_data`."""
+        if self._item_values is None:
+            self._item_values = self._get_data_from_item()
+        return self._item_values
+
     def _get_data_from_item(self):
         values = {}
         if not self._item:
@@ -330,6 +455,13 @@ class Form(object):
         """
         fields = {}
         factory = FieldFactory(self, self._translate)
+        if self._prototype is not None:
+            for name, field, sa_property, dtype in self._prototype.fields:
+                if dtype is None:
+                    fields[name] = factory.create(field)
+                else:
+                    fields[name] = factory.create(field, sa_property, dtype)
+            return fields
         for name, field in self._config.get_fields().iteritems():
             fields[name] = factory.create(field)
         return fields
@@ -1,5 +1,4 @@
 import os
-from dateutil import tz
 from formbar import static_dir
 
 def get_css_files():
@@ -57,6 +56,7 @@ def get_local_datetime(dt, timezone=None):
     :returns: datetime
 
     """
+    from dateutil import tz
     if not dt.tzinfo:
         dt = dt.replace(tzinfo=tz.gettz('UTC'))
     if not timezone:
@@ -75,6 +75,7 @@ def get_utc_datetime(dt, timezone=None):
     :returns: datetime
 
     """
+    from dateutil import tz
     if not timezone:
         dt = dt.replace(tzinfo=tz.tzlocal())
     timezone = tz.gettz('UTC')
@@ -1,4 +1,4 @@
-import xml.etree.ElementTree as ET
+from formbar import etree
 from formbar.config import get_text_and_html_content
 
 
@@ -16,7 +16,7 @@ def extract_i18n_formconfig(fileobj, keywords, comment_tags, options):
     :rtype: ``iterator``
     """
 
-    config = ET.parse(fileobj).getroot()
+    config = etree.parse(fileobj)
 
     # FIXME: Fix linenumbering. No real linenummer, just iterate somehow
     lineno = 0
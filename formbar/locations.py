@@ -0,0 +1,122 @@
+"""Resolution of package relative locations.
+
+Form configurations can refer to other files relative to a package
+using locations like ``@myapp/views/forms/form.xml``. The
+:class:`LocationResolver` resolves the location of a package once and
+remembers it for the following lookups.
+
+Applications can register the location of a package explicitly. This
+is useful if the files are not located in an installed package::
+
+    from formbar import locations
+    locations.register_location("myapp", "/srv/myapp")
+"""
+import os
+import sys
+import time
+import pkgutil
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class LocationResolver(object):
+    """Resolves and remembers the location of packages."""
+
+    def __init__(self):
+        self._locations = {}
+        self._registered = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._time = 0.0
+
+    def register_location(self, package, location):
+        """Registers the location for the given package. Registered
+        locations take precedence over the location of installed
+        packages.
+
+        :package: Name of the package
+        :location: Path of the directory which is used for the package
+        """
+        with self._lock:
+            self._registered[package] = location
+            self._locations.pop(package, None)
+
+    def clear(self):
+        """Forgets all resolved locations. Registered locations are
+        kept."""
+        with self._lock:
+            self._locations.clear()
+
+    def _find_location(self, package):
+        if package in self._registered:
+            return self._registered[package]
+        # The location of a package is the directory which contains the
+        # package. Packages which are already imported are taken from
+        # sys.modules, so other directories on the path like the
+        # working directory can not shadow them. Other packages are
+        # found on the path without importing them.
+        path = None
+        module = sys.modules.get(package)
+        if module is not None:
+            path = getattr(module, "__file__", None)
+            if path is not None and hasattr(module, "__path__"):
+                path = os.path.dirname(path)
+        else:
+            try:
+                path = getattr(pkgutil.get_loader(package), "filename", None)
+            except ImportError:
+                pass
+        if path is not None:
+            return os.path.dirname(os.path.abspath(path))
+        import pkg_resources
+        return pkg_resources.get_distribution(package).location
+
+    def resolve(self, package):
+        """Returns the location of the given package.
+
+        :package: Name of the package
+        :returns: Path of the directory containing the package
+        """
+        location = self._locations.get(package)
+        if location is not None:
+            with self._lock:
+                self._hits += 1
+            return location
+        start = time.time()
+        location = self._find_location(package)
+        duration = time.time() - start
+        log.debug("Resolved location of package '%s' to '%s' in %.6fs"
+                  % (package, location, duration))
+        with self._lock:
+            self._misses += 1
+            self._time += duration
+            self._locations[package] = location
+        return location
+
+    def stats(self):
+        """Returns a dictionary with the number of lookups of already
+        resolved locations (hits), the number of resolved locations
+        (misses) and the total time in seconds spent on resolving
+        locations (time)."""
+        with self._lock:
+            return {"hits": self._hits,
+                    "misses": self._misses,
+                    "time": self._time}
+
+resolver = LocationResolver()
+"""Default resolver"""
+
+
+def resolve(package):
+    """Returns the location of the given package using the default
+    resolver. See :meth:`LocationResolver.resolve`."""
+    return resolver.resolve(package)
+
+
+def register_location(package, location):
+    """Registers the location of a package in the default resolver. See
+    :meth:`LocationResolver.register_location`."""
+    resolver.register_location(package, location)
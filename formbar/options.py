@@ -0,0 +1,223 @@
+"""Cache of the options of relation fields.
+
+Relation fields load all items of the related class as options on every
+rendering of the field. The :class:`OptionCache` keeps the options of a
+class across requests and is shared by all fields of the same class.
+Options are cached as :class:`Option` snapshots which only contain the
+id, the label and the attributes used in the filter of the field, so
+they do not depend on the session they were loaded with.
+
+Caching is enabled per field by setting the ``cache`` attribute of the
+renderer to ``true``::
+
+    <renderer type="dropdown" cache="true"/>
+
+Options of fields without this attribute are loaded on every rendering
+as items of the class. Cached options are invalidated when items of the
+class are flushed or committed in any SQLAlchemy session, after a time
+to live and if the cache exceeds its size.
+
+Options are loaded as complete items of the class by default. If the
+label of the options is stored in a column of the class it can be
+configured in the ``labelcolumn`` attribute of the renderer. The options
+are then loaded with a query of the needed columns only (See
+:func:`query_options`)::
+
+    <renderer type="dropdown" labelcolumn="name"/>
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class Option(object):
+    """Snapshot of an option loaded from the database. The option
+    provides the id of the item, the label of the item and the
+    attributes of the item which have been loaded with the option."""
+
+    def __init__(self, id, label, attributes=None):
+        self.id = id
+        self.label = label
+        self._attributes = attributes or {}
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_attributes"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __unicode__(self):
+        return self.label
+
+    __str__ = __unicode__
+
+    def __repr__(self):
+        return "<Option %s %r>" % (self.id, self.label)
+
+
+class OptionCache(object):
+    """Thread safe cache of the options of mapped classes."""
+
+    def __init__(self, ttl=300, maxsize=128, max_rows=10000):
+        """
+        :ttl: Time to live of the cached options in seconds.
+        :maxsize: Maximum number of cached option lists. If the limit is
+                  reached the least recently used list is evicted.
+        :max_rows: Maximum number of options of a class. Options of
+                   classes with more items are not cached.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.hits = 0
+        """Number of option lists found in the cache"""
+        self.misses = 0
+        """Number of option lists which needed to be loaded"""
+        self.invalidations = 0
+        """Number of option lists removed because of changes"""
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._listening = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _listen(self):
+        import sqlalchemy as sa
+        with self._lock:
+            if self._listening:
+                return
+            sa.event.listen(sa.orm.Session, "after_flush", self._on_flush)
+            sa.event.listen(sa.orm.Session, "after_commit", self._on_commit)
+            sa.event.listen(sa.orm.Session, "after_rollback",
+                            self._on_rollback)
+            self._listening = True
+
+    def _on_flush(self, session, context):
+        changed = session.info.setdefault("formbar_changed_classes", set())
+        for item in list(session.new) + list(session.dirty) \
+                + list(session.deleted):
+            changed.add(type(item))
+        for clazz in changed:
+            self.invalidate(clazz)
+
+    def _on_commit(self, session):
+        # Options may have been loaded by other sessions between the
+        # flush and the commit.
+        for clazz in session.info.pop("formbar_changed_classes", ()):
+            self.invalidate(clazz)
+
+    def _on_rollback(self, session):
+        for clazz in session.info.pop("formbar_changed_classes", ()):
+            self.invalidate(clazz)
+
+    def get(self, clazz, attributes, query, label=None):
+        """Returns the list of :class:`Option` of the given class. The
+        options are only loaded if they are not already in the cache.
+
+        :clazz: SQLAlchemy mapped class of the options
+        :attributes: Names of the attributes of the items which are
+                     needed in the options.
+        :query: Query which loads the items of the class or the
+                :class:`Option` of the class.
+        :label: Name of the column with the label of the options if the
+                options are loaded with :func:`query_options`.
+        :returns: List of :class:`Option`
+        """
+        if not self._listening:
+            self._listen()
+        attributes = tuple(sorted(set(attributes)))
+        key = (clazz, label, attributes)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        options = []
+        for item in query:
+            if not isinstance(item, Option):
+                item = Option(item.id, unicode(item),
+                              dict((name, getattr(item, name))
+                                   for name in attributes))
+            options.append(item)
+        if len(options) > self.max_rows:
+            log.debug("Not caching %s options of %s"
+                      % (len(options), clazz.__name__))
+            return options
+        with self._lock:
+            self._entries[key] = (now, options)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return options
+
+    def invalidate(self, clazz=None):
+        """Removes the options of the given class and its subclasses
+        from the cache. If no class is given all options are removed.
+
+        :clazz: SQLAlchemy mapped class
+        """
+        with self._lock:
+            if clazz is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if issubclass(clazz, key[0]) or issubclass(key[0], clazz):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def stats(self):
+        """Returns a dictionary with the number of hits, misses,
+        invalidations and the number of cached option lists (size)."""
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "size": len(self._entries)}
+
+    def clear(self):
+        """Removes all options from the cache and resets the
+        counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+def query_options(session, clazz, label, attributes=()):
+    """Returns a query which only loads the columns of the class needed
+    for the options. The rows of the query are converted into
+    :class:`Option` by :func:`load_options`.
+
+    :session: SQLAlchemy session
+    :clazz: SQLAlchemy mapped class of the options
+    :label: Name of the column with the label of the options
+    :attributes: Names of the columns which are needed in the options
+    :returns: Query of the id, the label and the attributes
+    """
+    columns = [clazz.id, getattr(clazz, label)]
+    columns.extend(getattr(clazz, name) for name in attributes)
+    return session.query(*columns)
+
+
+def load_options(rows, attributes=()):
+    """Generates the :class:`Option` of the rows of a query created by
+    :func:`query_options`.
+
+    :rows: Rows of the query
+    :attributes: Names of the columns which are needed in the options
+    """
+    for row in rows:
+        label = row[1]
+        if label is None:
+            label = u""
+        yield Option(row[0], unicode(label), dict(zip(attributes, row[2:])))
+
+
+option_cache = OptionCache()
+"""Process wide cache of options of relation fields"""
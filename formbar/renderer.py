@@ -1,10 +1,10 @@
 import logging
 import difflib
-import xml.etree.ElementTree as ET
+import threading
+from formbar import etree
 from cgi import escape
 from webhelpers.html import literal, HTML
 
-from mako.lookup import TemplateLookup
 from formbar import template_dir
 from formbar.rules import Rule
 from formbar.fields import (
@@ -14,8 +14,29 @@ from formbar.fields import (
 )
 
 
-template_lookup = TemplateLookup(directories=[template_dir],
-                                 default_filters=['h'])
+class LazyTemplateLookup(object):
+    """Proxy for a :class:`mako.lookup.TemplateLookup`. The lookup (and
+    mako) is only loaded when it is used the first time."""
+
+    def __init__(self, **kwargs):
+        """
+        :kwargs: Arguments for the :class:`mako.lookup.TemplateLookup`
+        """
+        self._kwargs = kwargs
+        self._lookup = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._lookup is None:
+            with self._lock:
+                if self._lookup is None:
+                    from mako.lookup import TemplateLookup
+                    self._lookup = TemplateLookup(**self._kwargs)
+        return getattr(self._lookup, name)
+
+
+template_lookup = LazyTemplateLookup(directories=[template_dir],
+                                     default_filters=['h'])
 
 log = logging.getLogger(__name__)
 
@@ -153,7 +174,8 @@ class FormRenderer(Renderer):
                              method=self._form._config.method,
                              autocomplete=self._form._config.autocomplete,
                              enctype=self._form._config.enctype,
-                             evalurl=self._form._eval_url or ""))
+                             evalurl=self._form._eval_url or "",
+                             searchurl=self._form._search_url or ""))
         # Add hidden field with csrf_token if this is not None.
         if self._form._csrf_token:
             html.append(HTML.tag("input",
@@ -166,7 +188,7 @@ class FormRenderer(Renderer):
         values = {'form': self._form,
                   '_': self.translate,
                   'render_outline': render_outline,
-                  'ElementTree': ET,
+                  'ElementTree': etree,
                   'Rule': Rule}
         return literal(self.template.render(**values))
 
@@ -265,6 +287,13 @@ class FieldRenderer(Renderer):
                   '_': self.translate}
         return literal(template.render(**values))
 
+    def _render_constraints(self):
+        """Returns the HTML5 attributes for the constraints of the field
+        which can be checked by the browser."""
+        return literal(" ").join(literal('%s="%s"') % (name, value)
+                                 for name, value
+                                 in self._field.get_html_constraints())
+
     def _render_diff(self, newvalue, oldvalue):
         """Will return a HTML string showing the differences between the old
         and the new string.
@@ -490,12 +519,27 @@ class OptionFieldRenderer(FieldRenderer):
         FieldRenderer.__init__(self, field, translate)
         self._cache_options = None
 
+    def _get_selected_keys(self):
+        """Returns a set with the serialized values of the field as
+        strings. Options are selected if the string of their value is in
+        the set."""
+        value = self._field.get_value()
+        if not isinstance(value, list):
+            if isinstance(self._field.value, (list, tuple, set)):
+                # Selection fields serialize python lists as a whole.
+                value = [self._field._from_python(v)
+                         for v in self._field.value]
+            else:
+                value = [value]
+        return set(unicode(v) for v in value if v is not None)
+
     def _get_template_values(self):
         values = FieldRenderer._get_template_values(self)
         # Add the options to the values dictionary
         if self._cache_options is None:
             self._cache_options = self._field.get_options()
         values['options'] = self._cache_options
+        values['selected'] = self._get_selected_keys()
         return values
 
 
@@ -0,0 +1,197 @@
+"""Compiler for parsed rule expressions.
+
+The brabbel expression interpreter walks the parsed expression tree on
+every evaluation and decides for every token if it is an operator, a
+function, a variable or a constant. The compiler in this module does
+this once and builds a tree of Python closures instead. Variables are
+bound to lookups in the values, constants and functions are bound to
+the closures and operators are called directly.
+
+The compiled expression returns the same results and raises the same
+exceptions as :meth:`brabbel.expression.Expression.evaluate`. Parts of
+an expression which can not be compiled with exactly the same semantics
+are evaluated using the interpreter.
+
+The compiler is disabled by default. It can be enabled using
+:func:`formbar.rules.enable_compiler`.
+"""
+import logging
+from pyparsing import ParseResults
+from brabbel.operators import operators
+from brabbel.functions import functions
+from brabbel.expression import OperandMissmatchError
+
+log = logging.getLogger(__name__)
+
+
+class CompileError(Exception):
+    """Raised if a part of an expression can not be compiled."""
+    pass
+
+
+def _variable(key):
+    name = key.strip("$")
+
+    def variable(values):
+        try:
+            return values[name]
+        except KeyError:
+            log.warning("Variable %s could not found in the values." % name)
+            return None
+    return variable
+
+
+def _constant(value):
+    return lambda values: value
+
+
+def _operand(element):
+    if isinstance(element, str) and element.startswith("$"):
+        return _variable(element)
+    return _constant(element)
+
+
+def _function(func, element):
+    try:
+        param = _operand(element[0])
+    except Exception:
+        raise CompileError("Missing parameter of function")
+    return lambda values: func(param(values))
+
+
+def _mismatch(op, a, b):
+    msg = ("Can not use operands '%s' on operator '%s'. "
+           "Type of operands must be equal"
+           % ((a, type(a), b, type(b)), op))
+    raise OperandMissmatchError(msg)
+
+
+def _term(op, left, right):
+    """Returns a closure evaluating the term of the left and right
+    operand. See brabbel.expression._evaluate_term."""
+    if op is None:
+        def term(values):
+            a = left(values)
+            right(values)
+            return a
+    elif op == "not":
+        def term(values):
+            a = left(values)
+            right(values)
+            return not a
+    elif op == "in":
+        def term(values):
+            return left(values) in right(values)
+    elif op == "and":
+        and_ = operators[op]
+
+        def term(values):
+            a = left(values)
+            if not bool(a):
+                return False
+            b = right(values)
+            if type(a) != type(b):
+                _mismatch(op, a, b)
+            return and_(a, b)
+    elif op == "or":
+        or_ = operators[op]
+
+        def term(values):
+            a = left(values)
+            if bool(a):
+                return True
+            b = right(values)
+            if type(a) != type(b):
+                _mismatch(op, a, b)
+            return or_(a, b)
+    else:
+        func = operators[op]
+
+        def term(values):
+            a = left(values)
+            b = right(values)
+            if type(a) != type(b):
+                _mismatch(op, a, b)
+            return func(a, b)
+    return term
+
+
+def _compile(tree):
+    # Follows brabbel.expression.Expression._evaluate
+    acc = None
+    op = None
+    func = None
+    ops = set()
+    for element in tree:
+        if func:
+            operand = _function(func, element)
+            func = None
+        elif isinstance(element, ParseResults):
+            operand = _compile_group(element)
+        elif isinstance(element, basestring) and element in operators:
+            if acc is None and element in ("and", "or"):
+                raise CompileError("Missing operand for '%s'" % element)
+            op = element
+            ops.add(op)
+            continue
+        elif isinstance(element, basestring) and element in functions:
+            func = functions[element]
+            continue
+        else:
+            operand = _operand(element)
+        if acc is None:
+            acc = operand
+        else:
+            acc = _term(op, acc, operand)
+            op = None
+    if acc is None or func:
+        raise CompileError("Incomplete expression")
+    if ops & set(["and", "or"]) and len(ops) > 1:
+        # Short circuiting returns from the whole group in the
+        # interpreter. This is only equivalent to the compiled terms
+        # if all operators of the group are the same.
+        raise CompileError("Mixed operators")
+    if op is None:
+        return acc
+    elif op == "not":
+        return lambda values: not acc(values)
+    raise CompileError("Missing operand for '%s'" % op)
+
+
+def _compile_group(tree):
+    try:
+        return _compile(tree)
+    except CompileError:
+        return _interpreted(tree)
+
+
+def _interpreted(tree):
+    from brabbel.expression import Expression
+    # Evaluate the group using the interpreter.
+    expression = Expression.__new__(Expression)
+    expression._expression = tree
+    return lambda values: expression._evaluate(tree, values)
+
+
+def compile_tree(tree, expression=None):
+    """Returns a function which evaluates the given parsed expression
+    tree. The function takes the dictionary with the values as its only
+    argument.
+
+    :tree: Parsed expression tree
+    :expression: String of the expression. Used for log messages.
+    :returns: Function
+    """
+    func = _compile_group(tree)
+
+    def evaluate(values):
+        try:
+            return func(values)
+        except OperandMissmatchError as ex:
+            log.error("Can not evaluate expression '%s': %s"
+                      % (expression, ex.message))
+            raise
+        except:
+            log.exception("Can not evaluate expression '%s'" % expression)
+            raise
+    return evaluate
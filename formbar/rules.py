@@ -1,4 +1,156 @@
-from brabbel.expression import Expression
+import re
+import logging
+import datetime
+import threading
+from decimal import Decimal
+from collections import OrderedDict
+from brabbel.parser import Parser
+from brabbel.expression import Expression as BaseExpression
+from brabbel.functions import functions
+from formbar.rulecompiler import compile_tree
+
+log = logging.getLogger(__name__)
+
+use_compiler = False
+"""Flag to evaluate rules using compiled expressions. See
+:func:`enable_compiler`"""
+
+
+def enable_compiler(enabled=True):
+    """Enables or disables the evaluation of rules using expressions
+    compiled into Python functions. See :mod:`formbar.rulecompiler`.
+
+    :enabled: Flag to enable the compiler
+    """
+    global use_compiler
+    use_compiler = enabled
+
+
+class ExpressionCache(object):
+    """Thread safe LRU cache of parsed expressions. The parsed
+    expression trees are keyed by the string of the expression and are
+    shared between all expressions with the same string."""
+
+    def __init__(self, maxsize=4096):
+        """
+        :maxsize: Maximum number of parsed expressions kept in the
+                  cache. If the limit is reached the least recently
+                  used expression is evicted.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        """Number of expressions found in the cache"""
+        self.misses = 0
+        """Number of expressions which needed to be parsed"""
+        self._trees = OrderedDict()
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._trees)
+
+    def get(self, expression):
+        """Returns the parsed tree of the given expression. The
+        expression is only parsed if it is not already in the cache.
+
+        :expression: String representation of the expression
+        :returns: Parsed expression tree or None if the expression can
+                  not be parsed.
+        """
+        with self._lock:
+            tree = self._trees.pop(expression, None)
+            if tree is not None:
+                self._trees[expression] = tree
+                self.hits += 1
+                return tree
+            self.misses += 1
+        tree = self._parse(expression)
+        if tree is None:
+            return None
+        with self._lock:
+            self._trees[expression] = tree
+            while len(self._trees) > self.maxsize:
+                evicted, _ = self._trees.popitem(last=False)
+                self._compiled.pop(evicted, None)
+        return tree
+
+    def get_compiled(self, expression, tree):
+        """Returns the compiled function of the given expression. The
+        expression is only compiled if it is not already in the cache.
+
+        :expression: String representation of the expression
+        :tree: Parsed expression tree of the expression
+        :returns: Function which takes the values as argument
+        """
+        func = self._compiled.get(expression)
+        if func is not None:
+            return func
+        func = compile_tree(tree, expression)
+        with self._lock:
+            if expression in self._trees:
+                self._compiled[expression] = func
+        return func
+
+    def _parse(self, expression):
+        # pyparsing sometimes fails to parse an expression under heavy
+        # load. See brabbel.expression.Expression
+        tree = Parser().parse(expression)
+        for i in range(1, 6):
+            if tree is not None:
+                break
+            log.error("Parsing '%s' failed. Parsing it again... Try %s of 5"
+                      % (expression, i))
+            tree = Parser().parse(expression)
+        return tree
+
+    def stats(self):
+        """Returns a dictionary with the number of hits, misses and the
+        number of cached expressions (size)."""
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self._trees)}
+
+    def clear(self):
+        """Removes all expressions from the cache and resets the
+        counters."""
+        with self._lock:
+            self._trees.clear()
+            self._compiled.clear()
+            self.hits = 0
+            self.misses = 0
+
+expression_cache = ExpressionCache()
+"""Process wide cache of parsed expressions"""
+
+
+class Expression(BaseExpression):
+    """Expression which takes the parsed expression tree from the
+    process wide :data:`expression_cache` instead of parsing the
+    expression on every initialisation."""
+
+    def __init__(self, expression):
+        """Initialise a Expression object
+
+        :expression: String representation of an Expression
+
+        """
+        self._expression = expression
+        self._expression_tree = expression_cache.get(expression)
+        self._compiled = None
+
+    def _compile(self):
+        if self._compiled is None:
+            self._compiled = expression_cache.get_compiled(
+                self._expression, self._expression_tree)
+        return self._compiled
+
+    def evaluate(self, values=None):
+        if values is None:
+            values = {}
+        if use_compiler and self._expression_tree is not None:
+            return self._compile()(values)
+        return self._evaluate(self._expression_tree, values)
 
 
 class Rule(Expression):
@@ -58,6 +210,298 @@ class Rule(Expression):
         :returns: True or False
 
         """
-        if values is None:
-            values = {}
-        return bool(self._evaluate(self._expression_tree, values))
+        return bool(Expression.evaluate(self, values))
+
+
+class BoolRule(Rule):
+    """Rule which checks if the value of a field is set. The rule is
+    equivalent to the expression ``bool($name)`` but is evaluated
+    natively without parsing and interpreting the expression. It is used
+    for the rules of required and desired fields."""
+
+    def __init__(self, name, msg=None, mode='pre', triggers='error'):
+        """
+        :name: Name of the field which is checked
+        :msg: string error msg for the rule.
+        :mode: string of the mode when to evaluate this rule. Defaults
+        to 'pre'
+        :triggers: string of the type of "effect" this rule should
+        generate if the evaluation fails. Defaults to 'error'
+        """
+        self.name = name
+        self._expression = "bool($%s)" % name
+        self._compiled = None
+        self.msg = msg
+        if msg is None:
+            self.msg = 'Expression "%s" failed' % self._expression
+        self.mode = mode or 'pre'
+        self.triggers = triggers or 'error'
+        self.required = triggers != 'warning'
+        self.desired = not self.required
+
+    @property
+    def _expression_tree(self):
+        return expression_cache.get(self._expression)
+
+    def evaluate(self, values=None):
+        """Returns True if the value of the field is set. See the
+        ``bool`` function of brabbel.
+
+        :values: Dictionary with key value pairs containing values which
+        can be used while evaluation
+        :returns: True or False
+        """
+        try:
+            value = values[self.name]
+        except (KeyError, TypeError):
+            value = None
+        return bool(functions["bool"](value))
+
+
+class ConstraintRule(Rule):
+    """Base class of the rules for constraints of a field like the
+    minimum length or a pattern of the value. Constraints are evaluated
+    natively on the converted value of the field. Empty values are not
+    checked. Use the required flag of the field to enforce a value.
+
+    Constraints which can be expressed as brabbel expression have an
+    equivalent expression which is used on the client side."""
+
+    def __init__(self, name, value, msg=None, triggers='error'):
+        """
+        :name: Name of the field which is checked
+        :value: Value of the constraint. E.g the maximum length.
+        :msg: string error msg for the rule.
+        :triggers: string of the type of "effect" this rule should
+        generate if the evaluation fails. Defaults to 'error'
+        """
+        self.name = name
+        self.value = value
+        self.mode = 'post'
+        self.triggers = triggers or 'error'
+        self.required = False
+        self.desired = False
+        self._expression = self._get_expression()
+        self._compiled = None
+        self.msg = msg
+        if msg is None:
+            self.msg = 'Constraint "%s" failed' % self
+
+    def __repr__(self):
+        if self._expression is None:
+            return u"{}({}),{}".format(self.__class__.__name__,
+                                       self.value, self.triggers)
+        return Rule.__repr__(self)
+
+    def _get_expression(self):
+        """Returns the equivalent brabbel expression or None. Like the
+        constraint the expression must be true for empty values."""
+        return None
+
+    def prepare(self, datatype):
+        """Prepares the constraint for values of the given datatype of
+        the field. Raises a ValueError if the value of the constraint
+        can not be used for the datatype.
+
+        :datatype: Name of the datatype of the field or None if unknown
+        """
+        pass
+
+    @property
+    def _expression_tree(self):
+        if self._expression is None:
+            return None
+        return expression_cache.get(self._expression)
+
+    def check(self, value):
+        """Returns True if the value fulfills the constraint.
+
+        :value: Value of the field. Never None or empty
+        :returns: True or False
+        """
+        raise NotImplementedError()
+
+    def evaluate(self, values=None):
+        """Returns True if the value of the field fulfills the
+        constraint or if the field has no value.
+
+        :values: Dictionary with key value pairs containing values which
+        can be used while evaluation
+        :returns: True or False
+        """
+        try:
+            value = values[self.name]
+        except (KeyError, TypeError):
+            return True
+        if value is None or value == "" or value == []:
+            return True
+        return bool(self.check(value))
+
+
+class MinLengthRule(ConstraintRule):
+    """Checks the minimum length of the value. The length is computed
+    like the ``len`` function of brabbel."""
+
+    def __init__(self, name, value, msg=None, triggers='error'):
+        ConstraintRule.__init__(self, name, int(value), msg, triggers)
+
+    def _get_expression(self):
+        return "not bool($%s) or (len($%s) ge %s)" % (self.name, self.name,
+                                                      self.value)
+
+    def check(self, value):
+        return functions["len"](value) >= self.value
+
+
+class MaxLengthRule(MinLengthRule):
+    """Checks the maximum length of the value. The length is computed
+    like the ``len`` function of brabbel."""
+
+    def _get_expression(self):
+        return "not bool($%s) or (len($%s) le %s)" % (self.name, self.name,
+                                                      self.value)
+
+    def check(self, value):
+        return functions["len"](value) <= self.value
+
+
+class MinRule(ConstraintRule):
+    """Checks the minimum of the value. The value of the constraint is
+    converted into the type of the value of the field. Numbers, dates
+    (YYYY-MM-DD), datetimes (YYYY-MM-DD HH:MM:SS) and strings are
+    supported.
+
+    The equivalent expression for the client side is only available for
+    integer and float fields after :meth:`prepare` as brabbel requires
+    both operands of a comparison to have the same type."""
+
+    operator = "ge"
+
+    def __init__(self, name, value, msg=None, triggers='error'):
+        self._number = _to_number(value)
+        self._bounds = {}
+        ConstraintRule.__init__(self, name, value, msg, triggers)
+
+    def _get_literal(self, datatype):
+        """Returns the bound as brabbel literal of the type of the
+        values of the datatype or None."""
+        if datatype == "float":
+            literal = repr(float(self._number))
+        elif float(self._number).is_integer():
+            literal = str(int(self._number))
+        else:
+            return None
+        if _literal.match(literal) is None:
+            return None
+        return literal
+
+    def prepare(self, datatype):
+        if datatype in ("integer", "float", "integerselection"):
+            if self._number is None:
+                raise ValueError("'%s' is not a number" % self.value)
+            literal = self._get_literal(datatype)
+            if literal is not None:
+                self._expression = ("not bool($%s) or ($%s %s %s)"
+                                    % (self.name, self.name,
+                                       self.operator, literal))
+        elif datatype == "date":
+            self._convert(datetime.date)
+        elif datatype == "datetime":
+            self._convert(datetime.datetime)
+
+    def _convert(self, datatype):
+        bound = self._bounds.get(datatype)
+        if bound is None:
+            from formbar.converters import (to_date, to_datetime,
+                                            DeserializeException)
+            try:
+                if datatype is datetime.datetime:
+                    bound = to_datetime(self.value)
+                else:
+                    bound = to_date(self.value)
+            except DeserializeException:
+                raise ValueError("'%s' is not a valid %s"
+                                 % (self.value, datatype.__name__))
+            self._bounds[datatype] = bound
+        return bound
+
+    def _bound(self, value):
+        if isinstance(value, (int, long, float, Decimal)) \
+           and not isinstance(value, bool):
+            if self._number is None:
+                raise ValueError("'%s' is not a number" % self.value)
+            return self._number
+        if isinstance(value, basestring):
+            return unicode(self.value)
+        if isinstance(value, datetime.datetime):
+            return self._convert(datetime.datetime)
+        elif isinstance(value, datetime.date):
+            return self._convert(datetime.date)
+        return self.value
+
+    def check(self, value):
+        return value >= self._bound(value)
+
+
+class MaxRule(MinRule):
+    """Checks the maximum of the value. See :class:`MinRule`."""
+
+    operator = "le"
+
+    def check(self, value):
+        return value <= self._bound(value)
+
+
+class PatternRule(ConstraintRule):
+    """Checks if the whole value matches the regular expression. The
+    pattern is compiled once."""
+
+    def __init__(self, name, value, msg=None, triggers='error'):
+        ConstraintRule.__init__(self, name, value, msg, triggers)
+        self._regex = re.compile(u"(?:%s)\\Z" % value, re.UNICODE)
+
+    def check(self, value):
+        if isinstance(value, list):
+            return all(self.check(v) for v in value)
+        return self._regex.match(unicode(value)) is not None
+
+
+class OptionsRule(ConstraintRule):
+    """Checks if the value or all values of a list are one of the
+    given options. The value of the constraint is the list of the
+    allowed values."""
+
+    def __init__(self, name, value, msg=None, triggers='error'):
+        ConstraintRule.__init__(self, name, value, msg, triggers)
+        self._options = frozenset(unicode(v) for v in value)
+
+    def __repr__(self):
+        return u"OptionsRule({}),{}".format(self.name, self.triggers)
+
+    def check(self, value):
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        return all(unicode(v) in self._options for v in value)
+
+
+_literal = re.compile(r"-?[0-9]+(\.[0-9]+)?\Z")
+
+
+def _to_number(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+constraint_rules = {
+    "minlength": MinLengthRule,
+    "maxlength": MaxLengthRule,
+    "min": MinRule,
+    "max": MaxRule,
+    "pattern": PatternRule,
+    "options": OptionsRule
+}
+"""Mapping of the names of the constraints to the rule classes"""
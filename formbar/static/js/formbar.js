@@ -451,7 +451,8 @@ var form = function (inputFilter, ruleEngine) {
      * @param {Object} x - DOM-Node
      */
     scanForContentElements = function(x){
-        return $(x).find("input")[0]||$(x).find("textarea")[0]||$(x).find("select")[0];
+        // The search field of searchable options is no content element.
+        return $(x).find("input").not(".formbar-search")[0]||$(x).find("textarea")[0]||$(x).find("select")[0];
     }
 
     /**
@@ -919,6 +920,109 @@ var formbar = function (form) {
         toggleNextPageSubmit(e);
     };
 
+    /**
+     * @function
+     *
+     * loads a page of options of a searchable relation field from the
+     * server. Selected options are kept, all other options are replaced
+     * by the options of the first page or extended by the options of
+     * the following pages. Loading the first page aborts a pending
+     * request, so only the options of the latest term are shown.
+     *
+     * @param {Object} input - the search input of the field
+     *
+     * @param {number} page - the number of the page to load
+     *
+     */
+    var searchOptions = function (input, page) {
+        var select = $("#" + input.attr("data-target"));
+        var search_url = input.closest("form").attr("searchurl");
+        var pending = input.data("request");
+        if (!search_url) return;
+        if (pending) {
+            if (page != 1) return;
+            pending.abort();
+        }
+        var request = $.ajax({
+            type: "GET",
+            url: search_url,
+            data: {
+                field: input.attr("data-field"),
+                term: input.val(),
+                page: page
+            },
+            success: function (data) {
+                if (page == 1) {
+                    select.find("option").filter(function () {
+                        return !this.selected && this.value !== "";
+                    }).remove();
+                }
+                select.find("option.formbar-search-more").remove();
+                data.options.forEach(function (option) {
+                    var value = String(option.value);
+                    if (select.find("option").filter(function () {
+                            return this.value === value;
+                        }).length === 0) {
+                        select.append($("<option>").val(value).text(option.label));
+                    }
+                });
+                if (data.more) {
+                    select.append($("<option>").addClass("formbar-search-more")
+                        .prop("disabled", true).text("..."));
+                }
+                input.data("page", data.page);
+                input.data("more", data.more);
+            },
+            error: function (xhr, status) {
+                if (status !== "abort") {
+                    console.log("Request to search server fails!");
+                }
+            },
+            complete: function () {
+                if (input.data("request") === request) {
+                    input.removeData("request");
+                }
+            }
+        });
+        input.data("request", request);
+    };
+
+    /**
+     * @function
+     *
+     * handles initialization of the search fields of relation fields
+     * with many options.
+     *
+     */
+    var initSearch = function () {
+        $('.formbar-search').each(function () {
+            var input = $(this);
+            var timeOutID;
+            var select = $("#" + input.attr("data-target"));
+            input.on("keyup", function (e) {
+                // The search term is no value of the form.
+                e.stopPropagation();
+                if (timeOutID) clearTimeout(timeOutID);
+                timeOutID = setTimeout(function () {
+                    searchOptions(input, 1);
+                }, 300);
+            });
+            input.on("change", function (e) {
+                e.stopPropagation();
+            });
+            input.on("focus", function (e) {
+                if (!input.data("page")) searchOptions(input, 1);
+            });
+            select.on("scroll", function (e) {
+                var target = e.target;
+                if (input.data("more") &&
+                    target.scrollTop + target.clientHeight >= target.scrollHeight) {
+                    searchOptions(input, input.data("page") + 1);
+                }
+            });
+        });
+    };
+
     var init = function () {
         $('.formbar-tooltip').tooltip();
         $('.list-group-item').on('click', selectListGroupItem);
@@ -926,6 +1030,7 @@ var formbar = function (form) {
         $('div.formbar-outline a').click(navigate);
         $('div.formbar-form form').not(".disable-double-submit-prevention").preventDoubleSubmission();
         initDatePicker();
+        initSearch();
         initSubmit();
         form.init();
     };
@@ -7,17 +7,22 @@
     % endif
   </div>
 % else:
+  % if field.renderer.search:
+    ## Only the selected options are rendered. Other options are
+    ## searched on the server while typing into the search field.
+    <input type="text" class="form-control formbar-search" data-field="${field.name}" data-target="${field.id}" placeholder="${_('Search')}" autocomplete="off"/>
+  % endif
   <select class="form-control" id="${field.id}" name="${field.name}">
     % for option in options:
       ## Depending if the options has passed the configured filter the
       ## option will be visible or hidden
       % if option[2]:
-        % if str(option[1]) == str(field.get_value()):
+        % if unicode(option[1]) in selected:
           <option value="${option[1]}" selected="selected">${_(option[0])}</option>
         % else:
           <option value="${option[1]}">${_(option[0])}</option>
         % endif
-      % elif unicode(option[1]) == unicode(field.get_value()) and not field.renderer.remove_filtered == "true":
+      % elif unicode(option[1]) in selected and not field.renderer.remove_filtered == "true":
         <option value="${option[1]}" class="hidden">${_(option[0])}</option>
       % endif
     % endfor
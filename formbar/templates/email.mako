@@ -4,7 +4,7 @@
   </div>
 % else:
   <div class="input-group">
-    <input class="form-control email" id="${field.id}" type="text" name="${field.name}" value="${field.get_value()}" placeholder="mail@example.com"/>
+    <input class="form-control email" id="${field.id}" type="text" name="${field.name}" value="${field.get_value()}" placeholder="mail@example.com" ${renderer._render_constraints()}/>
     <div class="input-group-addon">
       <span class="glyphicon glyphicon-envelope"></span>
     </div>
@@ -2,5 +2,5 @@
   <div class="readonlyfield" name="${field.name}">
   </div>
 % else:
-  <input class="form-control" type="password" id="${field.id}" autocomplete="off" name="${field.name}"/>
+  <input class="form-control" type="password" id="${field.id}" autocomplete="off" name="${field.name}" ${renderer._render_constraints()}/>
 % endif
@@ -1,15 +1,7 @@
 <%
 readonly = (field.readonly and "disabled") or ""
-selected = field.get_value()
-if isinstance(selected, list):
+if isinstance(field.get_value(), list):
   raise TypeError("There can not be multiple selected values in a radio renderer!")
-
-  ## Check if the selection value is among the filtered options. If not the 
-filterd_values = [str(o[1]) for o in options if o[2]]
-if str(selected) in filterd_values:
-  selected = str(selected)
-else:
-  selected = ""
 %>
 
 % for num, option in enumerate(options):
@@ -17,7 +9,8 @@ else:
   ## option will be visible or hidden
   % if option[2]:
     <label class="radio-inline">
-      % if option[1] == selected:
+      ## Only options passing the filter can be selected.
+      % if unicode(option[1]) in selected:
         <input type="radio" id="${field.id}-${num}" datatype="${get_field_type(field)}" name="${field.name}" value="${option[1]}" checked="checked" ${readonly}/>
         ## Render a hidden field for selected readonly values to make sure the
         ## value is actually submitted.
@@ -1,18 +1,19 @@
-<%
-value = field.get_value() or []
-selected = [str(id) for id in value if id]
-%>
 % if field.readonly:
   <div class="readonlyfield" name="${field.name}">
     ${field.get_value(expand=True) or "&nbsp;"}
   </div>
 % else:
+  % if field.renderer.search:
+    ## Only the selected options are rendered. Other options are
+    ## searched on the server while typing into the search field.
+    <input type="text" class="form-control formbar-search" data-field="${field.name}" data-target="${field.id}" placeholder="${_('Search')}" autocomplete="off"/>
+  % endif
   <select class="form-control" id="${field.id}" name="${field.name}" size="5" multiple>
     % for option in options:
       ## Depending if the options has passed the configured filter the
       ## option will be visible or hidden
       % if option[2]:
-        % if str(option[1]) in selected:
+        % if unicode(option[1]) in selected:
           <option value="${option[1]}" selected="selected">${option[0]}</option>
         % else:
           <option value="${option[1]}">${option[0]}</option>
@@ -8,5 +8,5 @@
   </div>
   <input class="form-control ${get_field_type(field)}" type="hidden" datatype="${get_field_type(field)}" id="${field.id}" name="${field.name}" value="${field.get_value()}"/>
 % else:
-  <input ${'' if renderer._active else 'readonly=readonly '} class="form-control ${get_field_type(field)}" type="text" datatype="${get_field_type(field)}" id="${field.id}" name="${field.name}" value="${field.get_value()}" ${field.autofocus and 'autofocus'}/>
+  <input ${'' if renderer._active else 'readonly=readonly '} class="form-control ${get_field_type(field)}" type="text" datatype="${get_field_type(field)}" id="${field.id}" name="${field.name}" value="${field.get_value()}" ${field.autofocus and 'autofocus'} ${renderer._render_constraints()}/>
 % endif
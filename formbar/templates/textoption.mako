@@ -1,10 +1,8 @@
 <%
-value = field.get_value() or []
-selected = [str(id) for id in value if id]
 inputvalue = []
 for option in options:
-  if str(option[1]) in selected:
-    inputvalue.append(str(option[0]))
+  if unicode(option[1]) in selected:
+    inputvalue.append(unicode(option[0]))
 %>
 % if field.readonly:
   <div class="readonlyfield" name="${field.name}">
@@ -17,7 +15,7 @@ for option in options:
       ## Depending if the options has passed the configured filter the
       ## option will be visible or hidden
       % if option[2]:
-        % if str(option[1]) in selected:
+        % if unicode(option[1]) in selected:
           <option value="${option[1]}" selected="selected">${option[0]}</option>
         % else:
           <option value="${option[1]}">${option[0]}</option>
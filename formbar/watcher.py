@@ -0,0 +1,165 @@
+"""Reloading of modified form configurations.
+
+The :class:`Watcher` watches all files the configurations in a
+:class:`formbar.cache.ConfigCache` depend on. These are the
+configuration files itself and all files they inherit or include. If a
+file is modified only the configurations which depend on the file are
+removed from the cache and will be loaded again on the next access.
+All other configurations stay in the cache::
+
+    from formbar import cache
+    from formbar.watcher import Watcher
+
+    watcher = Watcher(cache.cache)
+    watcher.start()
+
+Changes are detected using inotify if `pyinotify
+<https://github.com/seb-m/pyinotify>`_ is installed. Otherwise the
+modification time of the files is polled. While the watcher is running
+the cache does not check the modification time of the files on every
+access anymore.
+"""
+import os
+import logging
+import threading
+import formbar.cache
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+log = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    """Watches the files of the configurations in a cache and
+    invalidates the configurations depending on modified files."""
+
+    def __init__(self, cache=None, interval=1.0, inotify=None):
+        """
+        :cache: :class:`formbar.cache.ConfigCache` to watch. Defaults to
+                the process wide cache.
+        :interval: Interval in seconds to poll for modifications if
+                   inotify is not used.
+        :inotify: Flag to use inotify. Defaults to use inotify if
+                  pyinotify is installed.
+        """
+        if cache is None:
+            cache = formbar.cache.cache
+        if inotify is None:
+            inotify = pyinotify is not None
+        elif inotify and pyinotify is None:
+            raise ValueError("inotify requires pyinotify to be installed")
+        self.cache = cache
+        self.interval = interval
+        self.inotify = inotify
+        self.listeners = []
+        """List of functions which are called with the path of a
+        modified file and the list of the invalidated configurations."""
+        self._check_mtime = cache.check_mtime
+        self._stopped = threading.Event()
+        self._thread = None
+        self._notifier = None
+        self._on_load = None
+        self._watches = {}
+
+    @property
+    def running(self):
+        return self._thread is not None or self._notifier is not None
+
+    def start(self):
+        """Starts watching the files in a background thread."""
+        if self.running:
+            return
+        self._check_mtime = self.cache.check_mtime
+        self.cache.check_mtime = False
+        self._stopped.clear()
+        if self.inotify:
+            self._start_inotify()
+        else:
+            self._thread = threading.Thread(target=self._poll,
+                                            name="formbar-watcher")
+            self._thread.daemon = True
+            self._thread.start()
+        log.debug("Started watching form configurations (%s)"
+                  % ("inotify" if self.inotify else "polling"))
+
+    def stop(self):
+        """Stops watching the files."""
+        if not self.running:
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._notifier is not None:
+            self.cache.listeners.remove(self._on_load)
+            self._notifier.stop()
+            self._notifier = None
+            self._on_load = None
+            self._watches = {}
+        self.cache.check_mtime = self._check_mtime
+
+    def changed(self, path):
+        """Invalidates all configurations depending on the given file.
+
+        :path: Path of the modified file
+        :returns: List with the paths of the invalidated configurations
+        """
+        invalidated = self.cache.invalidate(path)
+        if invalidated:
+            log.info("'%s' has been modified. Reloading %s"
+                     % (path, ", ".join(invalidated)))
+        for listener in self.listeners:
+            listener(path, invalidated)
+        return invalidated
+
+    def check(self):
+        """Checks the modification time of all files the cached
+        configurations depend on and invalidates the configurations
+        depending on modified files.
+
+        :returns: List with the paths of the invalidated configurations
+        """
+        invalidated = []
+        for path, mtime in self.cache.dependencies().iteritems():
+            try:
+                modified = os.path.getmtime(path) != mtime
+            except OSError:
+                modified = True
+            if modified:
+                invalidated.extend(self.changed(path))
+        return invalidated
+
+    def _poll(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                log.exception("Checking form configurations failed")
+
+    def _start_inotify(self):
+        manager = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+                | pyinotify.IN_DELETE)
+        watcher = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                path = event.pathname
+                if path in watcher.cache.dependencies():
+                    watcher.changed(path)
+
+        def watch(path, deps):
+            for dep in deps:
+                directory = os.path.dirname(dep)
+                if directory not in self._watches:
+                    self._watches.update(manager.add_watch(directory, mask))
+
+        self._on_load = watch
+        self._notifier = pyinotify.ThreadedNotifier(manager, Handler())
+        self._notifier.daemon = True
+        self._notifier.start()
+        self.cache.listeners.append(watch)
+        watch(None, self.cache.dependencies())
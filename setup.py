@@ -30,12 +30,15 @@ setup(name='formbar',
                       ],
     # Used for the example server
     tests_require=["nose"],
-    extras_require={'examples':  ["pyramid"]},
+    extras_require={'examples':  ["pyramid"],
+                    'lxml': ["lxml"]},
     setup_requires=[],
     entry_points="""
     # -*- Entry points: -*-
     [babel.extractors]
     formconfig = formbar.i18n:extract_i18n_formconfig
+    [console_scripts]
+    formbar-compile = formbar.bundle:main
     """,
 
     message_extractors = {'formbar': [
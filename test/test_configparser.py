@@ -1,7 +1,19 @@
 import unittest
 import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
 from formbar import test_dir
-from formbar.config import load, Config, Form
+from formbar.config import (
+    load, parse, Config, Form, merge_inherited, get_file_location
+)
+from formbar.cache import ConfigCache
+from formbar.watcher import Watcher
+from formbar import bundle
+from formbar import etree
+from formbar.locations import LocationResolver
 
 
 class TestConfigParser(unittest.TestCase):
@@ -15,6 +27,25 @@ class TestConfigParser(unittest.TestCase):
         self.assertRaises(
             KeyError, self.config.get_element, 'form', 'ambigous')
 
+    def test_get_element_ref(self):
+        config = Config(parse('<configuration>'
+                              '<entity id="e1" ref="e2"/>'
+                              '<entity id="e2" ref="e3"/>'
+                              '<entity id="e3" name="foo"/>'
+                              '<entity id="e4" ref="missing"/>'
+                              '</configuration>'))
+        self.assertEqual(config.get_element('entity', 'e1').attrib['name'],
+                         'foo')
+        self.assertEqual(config.get_element('entity', 'e4'), None)
+        self.assertEqual(config.get_element('entity', 'missing'), None)
+
+    def test_get_circular_element_fail(self):
+        config = Config(parse('<configuration>'
+                              '<entity id="e1" ref="e2"/>'
+                              '<entity id="e2" ref="e1"/>'
+                              '</configuration>'))
+        self.assertRaises(KeyError, config.get_element, 'entity', 'e1')
+
     def test_build_form_fail(self):
         """Check if a ValueError is raised if the Config is not instanciated
         with an ElementTree.Element.
@@ -92,6 +123,68 @@ class TestFormParser(unittest.TestCase):
     def test_id_custom(self):
         self.assertEqual(self.cform.id, 'customform')
 
+    def test_get_form_memoized(self):
+        self.assertTrue(self.config.get_form('customform') is self.cform)
+
+    def test_get_form_threads(self):
+        config = Config(load(os.path.join(test_dir, 'form.xml')))
+        forms = []
+
+        def get_form():
+            forms.append(config.get_form('customform'))
+        threads = [threading.Thread(target=get_form) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, forms))), 1)
+
+    def test_readonly_snapshot(self):
+        self.assertRaises(AttributeError, setattr, self.cform, 'css', 'x')
+
+    def test_evaluate_does_not_modify(self):
+        id2name = dict(self.cform._id2name)
+        fields = self.cform._fields
+        self.cform.get_fields(values={"select": 1}, evaluate=True)
+        self.assertEqual(self.cform._id2name, id2name)
+        self.assertTrue(self.cform._fields is fields)
+
+
+class TestConditionals(unittest.TestCase):
+
+    def setUp(self):
+        config = Config(parse(
+            '<configuration><source>'
+            '<entity id="e1" name="a" type="integer"/>'
+            '<entity id="e2" name="b"/>'
+            '<entity id="e3" name="c"/>'
+            '<entity id="e4" name="d"/>'
+            '</source>'
+            '<form id="f"><page id="p1"><field ref="e1"/>'
+            '<if expr="$a gt 1"><field ref="e2"/>'
+            '<if expr="$a gt 2"><field ref="e3"/></if></if>'
+            '<snippet ref="s1"/></page></form>'
+            '<snippet id="s1"><if expr="$a lt 1"><field ref="e4"/></if>'
+            '</snippet></configuration>'))
+        self.form = config.get_form('f')
+
+    def _legacy(self, values):
+        fields = self.form.init_fields(values, evaluate=True)
+        return set(name for page in fields.values() for name in page)
+
+    def test_active_fieldnames(self):
+        for values in ({}, {"a": 0}, {"a": 2}, {"a": 3}, {"a": "x"}):
+            self.assertEqual(self.form.get_active_fieldnames(values),
+                             self._legacy(values))
+
+    def test_nested(self):
+        self.assertEqual(self.form.get_active_fieldnames({"a": 3}),
+                         set(["a", "b", "c"]))
+
+    def test_get_fields_evaluate(self):
+        fields = self.form.get_fields(values={"a": 0}, evaluate=True)
+        self.assertEqual(sorted(fields), ["a", "d"])
+
 
 class TestFieldConfig(unittest.TestCase):
 
@@ -209,5 +302,437 @@ class TestFieldConfig(unittest.TestCase):
     def test_tags_custom(self):
         self.assertEqual(self.hfield.tags, ["tag1", "tag2"])
 
+class TestMergeInherited(unittest.TestCase):
+
+    def setUp(self):
+        self.ptree = parse('<configuration><source>'
+                           '<entity id="e1" name="a"/>'
+                           '<entity id="e2" name="b"/>'
+                           '</source><form id="f1"><field ref="e1"/></form>'
+                           '</configuration>')
+        self.tree = parse('<configuration><source>'
+                          '<entity id="e2" name="c"/>'
+                          '<entity id="e3" name="d"/>'
+                          '</source><form id="f1"><field ref="e3"/></form>'
+                          '<form id="f2"/></configuration>')
+        self.merged = merge_inherited(self.tree, self.ptree)
+
+    def test_replace(self):
+        entity = self.merged.find(".//entity[@id='e2']")
+        self.assertEqual(entity.attrib["name"], "c")
+        self.assertEqual(len(self.merged.findall(".//entity[@id='e2']")), 1)
+
+    def test_replace_keeps_position(self):
+        ids = [e.attrib["id"] for e in self.merged.find("source")]
+        self.assertEqual(ids, ["e1", "e2", "e3"])
+
+    def test_replace_nested(self):
+        refs = [f.attrib["ref"] for f in self.merged.findall(".//field")]
+        self.assertEqual(refs, ["e3"])
+
+    def test_add_toplevel(self):
+        self.assertEqual(self.merged[-1].attrib["id"], "f2")
+
+
+class TestMergeInheritedIds(unittest.TestCase):
+
+    def _merge(self, tree, ptree):
+        return merge_inherited(parse(tree), parse(ptree))
+
+    def _names(self, tree, xpath):
+        return [e.attrib["name"] for e in tree.findall(xpath)]
+
+    def test_duplicate_id(self):
+        # The first element in document order is replaced even if an
+        # element with the same id is closer to the root.
+        merged = self._merge('<configuration>'
+                             '<entity id="e1" name="new"/>'
+                             '</configuration>',
+                             '<configuration><source>'
+                             '<snippet><entity id="e1" name="nested"/>'
+                             '</snippet></source>'
+                             '<entity id="e1" name="toplevel"/>'
+                             '</configuration>')
+        self.assertEqual(self._names(merged, ".//entity"),
+                         ["new", "toplevel"])
+
+    def test_nested_id_after(self):
+        # The entity of the replaced form is the first element with its
+        # id in the merged tree. The entity in the source is kept.
+        merged = self._merge('<configuration><form id="f1">'
+                             '<entity id="e1" name="new"/>'
+                             '</form></configuration>',
+                             '<configuration><form id="f1"/><source>'
+                             '<entity id="e1" name="old"/>'
+                             '</source></configuration>')
+        self.assertEqual(self._names(merged, "form/entity"), ["new"])
+        self.assertEqual(self._names(merged, "source/entity"), ["old"])
+
+    def test_nested_id_before(self):
+        # The entity in the source comes first and is replaced as well.
+        merged = self._merge('<configuration><form id="f1">'
+                             '<entity id="e1" name="new"/>'
+                             '</form></configuration>',
+                             '<configuration><source>'
+                             '<entity id="e1" name="old"/>'
+                             '</source><form id="f1"/></configuration>')
+        self.assertEqual(self._names(merged, "form/entity"), ["new"])
+        self.assertEqual(self._names(merged, "source/entity"), ["new"])
+        self.assertTrue(merged.find("form/entity")
+                        is not merged.find("source/entity"))
+
+    def test_missing_parent(self):
+        self.assertRaises(AttributeError, self._merge,
+                          '<configuration><source>'
+                          '<entity id="e1" name="new"/>'
+                          '</source></configuration>',
+                          '<configuration/>')
+
+
+class TestXMLBackends(unittest.TestCase):
+
+    def tearDown(self):
+        etree.use()
+
+    def _load(self, backend):
+        etree.use(backend)
+        config = Config(load(os.path.join(test_dir, 'inherited.xml')))
+        form = config.get_form('customform')
+        elements = [(e.tag, sorted(e.attrib.items()), (e.text or "").strip())
+                    for e in config._tree.iter()]
+        return elements, sorted(form.get_fields())
+
+    def test_same_result(self):
+        try:
+            lxml = self._load(etree.LXML)
+        except ValueError:
+            raise unittest.SkipTest("lxml is not installed")
+        self.assertEqual(self._load(etree.STDLIB), lxml)
+
+    def test_sourceline(self):
+        try:
+            etree.use(etree.LXML)
+        except ValueError:
+            raise unittest.SkipTest("lxml is not installed")
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.assertEqual(etree.sourceline(tree.find('source')), 3)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, etree.use, 'unknown')
+
+
+class TestIncludes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpdir, 'address.xml'), 'w') as f:
+            f.write('<configuration><source id="address">'
+                    '<entity id="street" name="street"/>'
+                    '<rule expr="$street ne \'\'"/>'
+                    '</source></configuration>')
+        with open(os.path.join(self.tmpdir, 'form.xml'), 'w') as f:
+            f.write('<configuration>'
+                    '<include src="address.xml" element="address"'
+                    ' entity-prefix="home_"/>'
+                    '<include src="address.xml" element="address"'
+                    ' entity-prefix="work_"/>'
+                    '<include src="address.xml" element="address"'
+                    ' entity-prefix="work_"/>'
+                    '</configuration>')
+        self.deps = {}
+        self.tree = load(os.path.join(self.tmpdir, 'form.xml'), self.deps)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prefixes(self):
+        names = [e.attrib['name'] for e in self.tree.iter('entity')]
+        self.assertEqual(names, ['home_street', 'work_street', 'work_street'])
+        exprs = [e.attrib['expr'] for e in self.tree.iter('rule')]
+        self.assertEqual(exprs[0], "$home_street ne ''")
+        self.assertEqual(exprs[1], "$work_street ne ''")
+
+    def test_copies(self):
+        sources = list(self.tree)
+        self.assertFalse(sources[1] is sources[2])
+        self.assertFalse(sources[1][0] is sources[2][0])
+
+    def test_deps(self):
+        self.assertEqual(len(self.deps), 2)
+
+
+class TestLocationResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = LocationResolver()
+
+    def test_resolve_package(self):
+        location = self.resolver.resolve('formbar')
+        self.assertTrue(os.path.isdir(os.path.join(location, 'formbar')))
+
+    def test_resolve_memoized(self):
+        self.resolver.resolve('formbar')
+        self.resolver.resolve('formbar')
+        stats = self.resolver.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_resolve_imported_package(self):
+        # A package with the same name in another directory on the path
+        # does not shadow the imported package.
+        tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(tmpdir, 'formbar'))
+        open(os.path.join(tmpdir, 'formbar', '__init__.py'), 'w').close()
+        sys.path.insert(0, tmpdir)
+        try:
+            location = self.resolver.resolve('formbar')
+        finally:
+            sys.path.remove(tmpdir)
+            shutil.rmtree(tmpdir)
+        self.assertEqual(location, os.path.dirname(test_dir))
+
+    def test_resolve_without_import(self):
+        tmpdir = tempfile.mkdtemp()
+        package = os.path.join(tmpdir, 'formbar_testpackage')
+        os.mkdir(package)
+        with open(os.path.join(package, '__init__.py'), 'w') as f:
+            f.write('raise RuntimeError("Imported")\n')
+        sys.path.insert(0, tmpdir)
+        try:
+            location = self.resolver.resolve('formbar_testpackage')
+        finally:
+            sys.path.remove(tmpdir)
+            shutil.rmtree(tmpdir)
+        self.assertEqual(location, tmpdir)
+        self.assertFalse('formbar_testpackage' in sys.modules)
+
+    def test_register_location(self):
+        self.resolver.resolve('formbar')
+        self.resolver.register_location('formbar', '/tmp/formbar')
+        self.assertEqual(self.resolver.resolve('formbar'), '/tmp/formbar')
+
+    def test_file_location(self):
+        path = get_file_location('@formbar/test/form.xml', '')
+        self.assertEqual(path, os.path.join(test_dir, 'form.xml'))
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('form.xml', 'include.xml', 'inherited.xml'):
+            shutil.copy(os.path.join(test_dir, name), self.tmpdir)
+        self.cache = ConfigCache(maxsize=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _touch(self, name):
+        path = os.path.join(self.tmpdir, name)
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_load_cached(self):
+        path = os.path.join(self.tmpdir, 'inherited.xml')
+        tree = self.cache.load(path)
+        self.assertTrue(self.cache.load(path) is tree)
+
+    def test_load_equals_uncached(self):
+        from xml.etree.ElementTree import tostring
+        path = os.path.join(self.tmpdir, 'inherited.xml')
+        self.assertEqual(tostring(self.cache.load(path)),
+                         tostring(load(path)))
+
+    def test_reload_on_modified_dependency(self):
+        path = os.path.join(self.tmpdir, 'inherited.xml')
+        tree = self.cache.load(path)
+        self._touch('include.xml')
+        self.assertFalse(self.cache.load(path) is tree)
+
+    def test_invalidate_dependency(self):
+        path = os.path.join(self.tmpdir, 'inherited.xml')
+        self.cache.load(path)
+        self.cache.invalidate(os.path.join(self.tmpdir, 'form.xml'))
+        self.assertFalse(path in self.cache)
+
+    def test_get_config(self):
+        path = os.path.join(self.tmpdir, 'inherited.xml')
+        config = self.cache.get_config(path)
+        self.assertTrue(self.cache.get_config(path) is config)
+        self._touch('form.xml')
+        self.assertFalse(self.cache.get_config(path) is config)
+
+    def test_lru_eviction(self):
+        for name in ('form.xml', 'include.xml', 'inherited.xml'):
+            self.cache.load(os.path.join(self.tmpdir, name))
+        self.assertEqual(len(self.cache), 2)
+        self.assertFalse(os.path.join(self.tmpdir, 'form.xml') in self.cache)
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('form.xml', 'include.xml', 'inherited.xml'):
+            shutil.copy(os.path.join(test_dir, name), self.tmpdir)
+        self.cache = ConfigCache()
+        self.watcher = Watcher(self.cache, interval=0.01, inotify=False)
+        self.form = os.path.join(self.tmpdir, 'form.xml')
+        self.inherited = os.path.join(self.tmpdir, 'inherited.xml')
+        self.include = os.path.join(self.tmpdir, 'include.xml')
+        self.cache.load(self.form)
+        self.cache.load(self.inherited)
+        self.cache.load(self.include)
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _touch(self, path):
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_check_unmodified(self):
+        self.assertEqual(self.watcher.check(), [])
+        self.assertEqual(len(self.cache), 3)
+
+    def test_check_invalidates_dependents(self):
+        self._touch(self.form)
+        self.assertEqual(sorted(self.watcher.check()),
+                         sorted([self.form, self.inherited]))
+        self.assertTrue(self.include in self.cache)
+
+    def test_background_thread(self):
+        changes = []
+        self.watcher.listeners.append(lambda path, invalid: changes.append(path))
+        self.watcher.start()
+        self.assertFalse(self.cache.check_mtime)
+        self._touch(self.include)
+        for i in range(200):
+            if changes:
+                break
+            threading.Event().wait(0.01)
+        self.watcher.stop()
+        self.assertTrue(self.cache.check_mtime)
+        self.assertEqual(changes, [self.include])
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('form.xml', 'include.xml'):
+            shutil.copy(os.path.join(test_dir, name), self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'form.xml')
+        self.config = Config(load(self.path))
+        self.bundle = bundle.compile_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compile(self):
+        self.assertEqual(self.bundle, self.path + bundle.SUFFIX)
+        self.assertTrue(os.path.exists(self.bundle))
+
+    def test_load_fields(self):
+        config = bundle.load(self.bundle)
+        form = config.get_form('customform')
+        expected = self.config.get_form('customform')
+        self.assertEqual(sorted(form.get_fields().keys()),
+                         sorted(expected.get_fields().keys()))
+        self.assertEqual(form._id2name, expected._id2name)
+
+    def test_load_rules(self):
+        config = bundle.load(self.bundle)
+        form = config.get_form('customform')
+        expected = self.config.get_form('customform')
+        for name, field in expected.get_fields().iteritems():
+            cfield = form.get_field(name)
+            self.assertEqual(len(cfield.get_rules()), len(field.get_rules()))
+            self.assertEqual(len(cfield.get_validators()),
+                             len(field.get_validators()))
+
+    def test_load_conditionals(self):
+        path = os.path.join(self.tmpdir, 'conditionals.xml')
+        with open(path, 'w') as f:
+            f.write('<configuration><source>'
+                    '<entity id="e1" name="a" type="integer"/>'
+                    '<entity id="e2" name="b" type="integer"/>'
+                    '<entity id="e3" name="c" type="integer"/>'
+                    '</source><form id="f"><field ref="e1"/>'
+                    '<if expr="$a == 1"><field ref="e2"/>'
+                    '<if expr="$b == 2"><field ref="e3"/></if></if>'
+                    '</form></configuration>')
+        expected = Config(load(path)).get_form('f')
+        bundle.compile_file(path)
+        build = Form._build_conditionals
+        Form._build_conditionals = None
+        try:
+            form = bundle.load(path + bundle.SUFFIX).get_form('f')
+        finally:
+            Form._build_conditionals = build
+        self.assertEqual(form.dump_conditionals(),
+                         expected.dump_conditionals())
+        for values in ({}, {"a": 1}, {"a": 1, "b": 2}, {"a": 2, "b": 2}):
+            self.assertEqual(form.get_active_fieldnames(values),
+                             expected.get_active_fieldnames(values))
+
+    def test_load_config_prefers_bundle(self):
+        config = bundle.load_config(self.path)
+        self.assertTrue(config._compiled is not None)
+
+    def test_invalid_hash(self):
+        with open(self.bundle, 'rb') as f:
+            data = f.read()
+        self.assertRaises(bundle.BundleError, bundle.loads, data[:-1] + 'x')
+
+    def test_load_config_ignores_outdated_bundle(self):
+        with open(self.bundle, 'rb') as f:
+            data = f.read()
+        with open(self.bundle, 'wb') as f:
+            f.write(data[:4] + '\xff\xff' + data[6:])
+        config = bundle.load_config(self.path)
+        self.assertTrue(config._compiled is None)
+
+    def _edit(self, name):
+        path = os.path.join(self.tmpdir, name)
+        with open(path) as f:
+            data = f.read()
+        with open(path, 'w') as f:
+            f.write(data.replace('</configuration>',
+                                 '<!-- edited --></configuration>'))
+
+    def test_load_config_ignores_changed_source(self):
+        self._edit('form.xml')
+        config = bundle.load_config(self.path)
+        self.assertTrue(config._compiled is None)
+
+    def test_load_config_ignores_changed_dependency(self):
+        self._edit('include.xml')
+        config = bundle.load_config(self.path)
+        self.assertTrue(config._compiled is None)
+
+    def test_load_checks_source(self):
+        bundle.load(self.bundle, self.path)
+        os.remove(os.path.join(self.tmpdir, 'include.xml'))
+        self.assertRaises(bundle.BundleError, bundle.load,
+                          self.bundle, self.path)
+        self.assertTrue(bundle.load(self.bundle)._compiled is not None)
+
+
+class TestImport(unittest.TestCase):
+
+    def test_lazy_dependencies(self):
+        """Importing formbar must not import heavy dependencies. They
+        are imported on first use."""
+        script = ("import sys; import formbar.form; "
+                  "print ' '.join(sorted(m for m in ('sqlalchemy', 'mako', "
+                  "'babel', 'dateutil', 'pkg_resources') "
+                  "if m in sys.modules))")
+        output = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEqual(output.strip(), '')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@ import os
 import datetime
 import unittest
 
+import sqlalchemy as sa
 from sqlalchemy import create_engine, Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
@@ -12,8 +13,10 @@ Session.configure(bind=engine)
 Base = declarative_base()
 
 from formbar import test_dir
+from formbar import etree
 from formbar.config import load, Config
-from formbar.form import Form, StateError, Validator
+from formbar.form import Form, StateError, Validator, get_prototype
+from formbar.rules import Expression
 
 RESULT="""<html><body><div class="formbar-form"><form id="customform" class="testcss" method="GET" action="http://" autocomplete="off"> <div class="row-fluid"> <div class="span12"> <label for="string"> String field</label> <div class="readonlyfield"> &nbsp; </div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="default"> Default</label> <div class="readonlyfield"> &nbsp; </div> </div> <div class="span6"> <label for="select"> Select</label> <div class="readonlyfield"> &nbsp; </div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="float"> Float field</label> <div class="readonlyfield"> &nbsp; </div> <div class="text-help"> <i class="icon-info-sign"></i> This is is a very long helptext which should span over multiple rows. Further the will check if there are further html tags allowed.</div> </div> <div class="span6"> <label for="date"> <sup>(1)</sup> Date field</label> <div class="readonlyfield"> &nbsp; </div> <div class="text-help"> <i class="icon-info-sign"></i> This is my helptext</div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="string"> String field</label> <div class="readonlyfield"> &nbsp; </div> </div> <div class="span6"> <label for="integer"> Integer field <a href="#" data-toggle="tooltip" class="formbar-tooltip" data-original-title="Required fa_field"><i class="icon-asterisk"></i></a></label> <div class="readonlyfield"> &nbsp; </div> </div> </div>
 </form></div></body></html>"""
@@ -39,6 +42,18 @@ class User(Base):
         return "<User('%s','%s', '%s')>" % (self.name, self.fullname,
                                             self.password)
 
+
+class Task(Base):
+    __tablename__ = 'tasks'
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, sa.ForeignKey('users.id'))
+    owner = sa.orm.relationship(User)
+
+    def get_values(self):
+        return {"owner": self.owner}
+
+
 class TestInheritedForm(unittest.TestCase):
 
     def setUp(self):
@@ -198,6 +213,131 @@ class TestFormValidation(unittest.TestCase):
         self.assertEqual(num_rules, 3)
 
 
+class TestConstraints(unittest.TestCase):
+
+    def setUp(self):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="code" type="string" minlength="2"'
+            ' maxlength="4" pattern="[A-Z]+"/>'
+            '<entity id="e2" name="age" type="integer" min="0" max="150">'
+            '<constraint type="max" value="120" triggers="warning"'
+            ' msg="Really?"/></entity>'
+            '<entity id="e3" name="day" type="date" min="2015-01-01"/>'
+            '<entity id="e4" name="color" type="string">'
+            '<options><option value="red">Red</option>'
+            '<option value="blue">Blue</option></options>'
+            '<constraint type="options"/></entity>'
+            '</source><form id="f">'
+            '<field ref="e1"/><field ref="e2"/><field ref="e3"/>'
+            '<field ref="e4"/></form></configuration>')
+        self.config = Config(tree).get_form("f")
+
+    def _validate(self, values):
+        form = Form(self.config)
+        form.validate(values)
+        return form
+
+    def test_valid(self):
+        form = self._validate({"code": "AB", "age": "30",
+                               "day": "2015-02-01", "color": "red"})
+        self.assertFalse(form.has_errors())
+        self.assertEqual(form.get_warnings(), {})
+
+    def test_empty_values_are_not_checked(self):
+        form = self._validate({"code": "", "age": "", "day": ""})
+        self.assertFalse(form.has_errors())
+
+    def test_invalid(self):
+        form = self._validate({"code": "ABCDE", "age": "-1",
+                               "day": "2014-12-31", "color": "green"})
+        self.assertEqual(sorted(form.get_errors()),
+                         ["age", "code", "color", "day"])
+        self.assertEqual(len(form.get_errors()["code"]), 1)
+
+    def test_pattern(self):
+        form = self._validate({"code": "ab"})
+        self.assertEqual(form.get_errors()["code"],
+                         ["The value does not match the required format"])
+
+    def test_warning(self):
+        form = self._validate({"age": "130"})
+        self.assertFalse(form.has_errors())
+        self.assertEqual(form.get_warnings()["age"], ["Really?"])
+
+    def test_client_rules(self):
+        from formbar.fields import rules_to_string
+        field = Form(self.config).get_field("code")
+        self.assertEqual(rules_to_string(field),
+                         [u"not bool($code) or (len($code) ge 2),error",
+                          u"not bool($code) or (len($code) le 4),error"])
+        html = field.render(True)
+        self.assertTrue('pattern="[A-Z]+"' in html)
+        self.assertTrue('maxlength="4"' in html)
+
+    def test_client_rules_numbers(self):
+        from formbar.fields import rules_to_string
+        field = Form(self.config).get_field("age")
+        self.assertEqual(rules_to_string(field),
+                         [u"not bool($age) or ($age ge 0),error",
+                          u"not bool($age) or ($age le 150),error",
+                          u"not bool($age) or ($age le 120),warning"])
+
+    def test_client_rules_float(self):
+        rules = self._get_rules('<entity id="e1" name="name" type="float"'
+                                ' min="0.5" max="100"/>')
+        self.assertEqual([r._expression for r in rules],
+                         ["not bool($name) or ($name ge 0.5)",
+                          "not bool($name) or ($name le 100.0)"])
+        for rule in rules:
+            expression = Expression(rule._expression)
+            self.assertTrue(expression.evaluate({"name": 5.5}))
+
+    def test_client_rules_not_numeric(self):
+        for entity in ('<entity id="e1" name="name" type="string"'
+                       ' max="10"/>',
+                       '<entity id="e1" name="name" type="date"'
+                       ' min="2015-01-01"/>',
+                       '<entity id="e1" name="name" type="integer"'
+                       ' min="1.5"/>'):
+            rules = self._get_rules(entity)
+            self.assertEqual([r._expression for r in rules], [None])
+
+    def test_client_rules_skip_empty_values(self):
+        for name in ("code", "age"):
+            for rule in Form(self.config).get_field(name).get_rules():
+                if rule._expression is None:
+                    continue
+                expression = Expression(rule._expression)
+                self.assertTrue(expression.evaluate({name: ""}))
+                self.assertTrue(expression.evaluate({name: None}))
+
+    def _get_rules(self, entity):
+        tree = etree.fromstring(
+            '<configuration><source>%s</source><form id="f">'
+            '<field ref="e1"/></form></configuration>' % entity)
+        return Config(tree).get_form("f").get_field("name").get_rules()
+
+    def test_invalid_bounds(self):
+        for entity in ('<entity id="e1" name="name" type="date"'
+                       ' min="yesterday"/>',
+                       '<entity id="e1" name="name" type="datetime"'
+                       ' max="2015-13-01"/>',
+                       '<entity id="e1" name="name" type="integer"'
+                       ' max="many"/>',
+                       '<entity id="e1" name="name" type="string"'
+                       ' minlength="two"/>',
+                       '<entity id="e1" name="name" type="string"'
+                       ' pattern="[A-Z"/>'):
+            self.assertRaises(ValueError, self._get_rules, entity)
+
+    def test_string_bounds(self):
+        rules = self._get_rules('<entity id="e1" name="name" type="string"'
+                                ' min="b"/>')
+        self.assertTrue(rules[0].evaluate({"name": u"c"}))
+        self.assertFalse(rules[0].evaluate({"name": u"a"}))
+
+
 class TestFormRenderer(unittest.TestCase):
 
     def setUp(self):
@@ -276,5 +416,552 @@ class TestFormAlchemyForm(unittest.TestCase):
         self.assertEqual(result[1].name, "paulpaulpaul")
 
 
+class TestFormPrototype(unittest.TestCase):
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.config = Config(tree)
+        self.session = Session()
+
+    def tearDown(self):
+        Session.remove()
+
+    def test_memoized(self):
+        form_config = self.config.get_form('customform')
+        self.assertTrue(get_prototype(form_config)
+                        is get_prototype(form_config))
+        self.assertFalse(get_prototype(form_config)
+                         is get_prototype(form_config, User))
+
+    def test_same_fields(self):
+        form_config = self.config.get_form('customform')
+        form = Form(form_config)
+        created = get_prototype(form_config).create()
+        self.assertEqual(sorted(form.fields), sorted(created.fields))
+        for name, field in form.fields.iteritems():
+            self.assertEqual(type(created.fields[name]), type(field))
+            self.assertEqual(type(created.fields[name].renderer),
+                             type(field.renderer))
+        self.assertEqual(created.render(), form.render())
+
+    def test_separate_state(self):
+        prototype = get_prototype(self.config.get_form('customform'))
+        form1 = prototype.create()
+        form2 = prototype.create()
+        self.assertFalse(form1.validate({"integer": "foo"}))
+        self.assertTrue(form1.has_errors())
+        self.assertFalse(form2.has_errors())
+
+    def test_item(self):
+        form_config = self.config.get_form('userform2')
+        prototype = get_prototype(form_config, User)
+        item = User()
+        form = prototype.create(item, self.session)
+        direct = Form(form_config, item, self.session)
+        for name, field in direct.fields.iteritems():
+            self.assertEqual(form.fields[name]._sa_property,
+                             field._sa_property)
+        self.assertRaises(TypeError, prototype.create, object())
+
+    def _assertSameFields(self, form, direct):
+        self.assertEqual(sorted(form.fields), sorted(direct.fields))
+        for name, field in direct.fields.iteritems():
+            self.assertEqual(type(form.fields[name]), type(field), name)
+            self.assertEqual(form.fields[name]._sa_property,
+                             field._sa_property)
+
+    def test_item_class(self):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="owner"/>'
+            '<entity id="e2" name="owner.name"/>'
+            '</source><form id="f"><field ref="e1"/><field ref="e2"/>'
+            '</form></configuration>')
+        form_config = Config(tree).get_form("f")
+        task = Task(owner=User(u"ed"))
+        with_class = get_prototype(form_config, Task)
+        without_class = get_prototype(form_config)
+        self._assertSameFields(with_class.create(task, self.session),
+                               Form(form_config, task, self.session))
+        self._assertSameFields(with_class.create(None, self.session),
+                               Form(form_config, None, self.session))
+        self._assertSameFields(without_class.create(None, self.session),
+                               Form(form_config, None, self.session))
+        self.assertRaises(TypeError, without_class.create, task,
+                          self.session)
+
+
+class TestDefaultExpressions(unittest.TestCase):
+
+    def setUp(self):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="name" type="string"/>'
+            '<entity id="e2" name="password" type="integer"/>'
+            '<entity id="e3" name="fullname" type="string"'
+            ' value="%$name + \' \' + $name"/>'
+            '<entity id="e4" name="id" type="integer"'
+            ' value="%$password * 2"/>'
+            '</source><form id="f">'
+            '<field ref="e1"/><field ref="e2"/><field ref="e3"/>'
+            '<field ref="e4"/></form></configuration>')
+        self.config = Config(tree).get_form("f")
+
+    def test_item_values_loaded_once(self):
+        calls = []
+
+        class CountingForm(Form):
+            def _get_data_from_item(self):
+                calls.append(1)
+                return Form._get_data_from_item(self)
+
+        form = CountingForm(self.config, User(u"ed", None, 21))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(form.merged_data["fullname"], u"ed ed")
+        self.assertEqual(form.merged_data["id"], 42)
+
+    def test_expression_shared(self):
+        field = self.config.get_field("fullname")
+        self.assertTrue(field.get_value_expression()
+                        is field.get_value_expression())
+        self.assertEqual(self.config.get_field("name").get_value_expression(),
+                         None)
+
+
+class TestSelectionOptions(unittest.TestCase):
+
+    class Request(object):
+        def __init__(self, group):
+            self.user = type("User", (object,), {"group": group})()
+
+    def setUp(self):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="color" type="string">'
+            '<renderer type="dropdown" filter="%group == $user.group"'
+            ' sort="true"/>'
+            '<options><option value="r" group="a">Red</option>'
+            '<option value="b" group="b">Blue</option>'
+            '<option value="g" group="a">Green</option></options>'
+            '</entity></source><form id="f"><field ref="e1"/></form>'
+            '</configuration>')
+        self.config = Config(tree).get_form("f")
+
+    def _get_options(self, group):
+        field = Form(self.config, request=self.Request(group))\
+            .get_field("color")
+        calls = []
+        filter_options = field.filter_options
+        field.filter_options = lambda o: calls.append(o) or filter_options(o)
+        return field.get_options(), len(calls)
+
+    def test_memoized(self):
+        options, calls = self._get_options("a")
+        self.assertEqual(options, [("Blue", "b", False), ("Green", "g", True),
+                                   ("Red", "r", True)])
+        self.assertEqual(calls, 1)
+        self.assertEqual(self._get_options("a"), (options, 0))
+
+    def test_changed_values(self):
+        options, calls = self._get_options("a")
+        options, calls = self._get_options("b")
+        self.assertEqual(calls, 1)
+        self.assertEqual([o[1] for o in options if o[2]], ["b"])
+
+
+class TestOptionTemplates(unittest.TestCase):
+
+    def setUp(self):
+        options = ('<options><option value="a">A</option>'
+                   '<option value="b">B</option>'
+                   '<option value="c">C</option></options>')
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="single" type="string">'
+            '<renderer type="dropdown"/>%s</entity>'
+            '<entity id="e2" name="multi" type="string">'
+            '<renderer type="checkbox"/>%s</entity>'
+            '<entity id="e3" name="choice" type="string">'
+            '<renderer type="radio"/>%s</entity>'
+            '</source><form id="f"><field ref="e1"/><field ref="e2"/>'
+            '<field ref="e3"/></form></configuration>'
+            % (options, options, options))
+        self.form = Form(Config(tree).get_form("f"))
+
+    def test_selected(self):
+        html = self.form.render({"single": "b", "multi": ["a", "c"],
+                                 "choice": "c"})
+        self.assertTrue('<option value="b" selected="selected">' in html)
+        self.assertEqual(html.count('selected="selected"'), 1)
+        # Including the empty hidden checkbox to deselect all options.
+        self.assertEqual(html.count('checked="checked"'), 4)
+        self.assertTrue('name="multi" value="c" checked="checked"' in html)
+        self.assertTrue('name="choice" value="c" checked="checked"' in html)
+        html = self.form.render({"multi": "{a,b}"})
+        self.assertTrue('name="multi" value="b" checked="checked"' in html)
+
+    def _radio_form(self):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="choice" type="string">'
+            '<renderer type="radio"/><options>'
+            '<option value="">None</option><option value="a">A</option>'
+            '</options></entity></source><form id="f"><field ref="e1"/>'
+            '</form></configuration>')
+        return Form(Config(tree).get_form("f"))
+
+    def test_empty_value(self):
+        form = self._radio_form()
+        html = form.render({"choice": ""})
+        self.assertTrue('value="" checked="checked"' in html)
+        self.assertEqual(html.count('checked="checked"'), 1)
+        self.assertTrue('value="a" checked="checked"'
+                        in form.render({"choice": "a"}))
+
+    def test_radio_list_value(self):
+        form = self._radio_form()
+        field = form.get_field("choice")
+        field.get_value = lambda *args, **kwargs: [u"a"]
+        self.assertRaises(TypeError, form.render)
+
+    def test_expand_value(self):
+        field = self.form.get_field("multi")
+        self.assertEqual(field.expand_value(["a", "x", "c"]), "A, C")
+        self.assertEqual(field.expand_value("b"), "B")
+
+
+class TestRelationConverters(unittest.TestCase):
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.users = [User(u"user%s" % i) for i in range(3)]
+        self.session.add_all(self.users)
+        self.session.flush()
+        self.ids = [u.id for u in self.users]
+        self.queries = []
+        sa.event.listen(engine, "before_cursor_execute", self._count)
+
+    def tearDown(self):
+        sa.event.remove(engine, "before_cursor_execute", self._count)
+        self.session.rollback()
+        Session.remove()
+
+    def _count(self, conn, cursor, statement, *args):
+        self.queries.append(statement)
+
+    def test_identity_map(self):
+        from formbar.converters import to_manytomany
+        items = to_manytomany(User, list(reversed(self.ids)),
+                              self.session, [])
+        self.assertEqual(items, list(reversed(self.users)))
+        self.assertEqual(self.queries, [])
+
+    def test_single_query(self):
+        from formbar.converters import to_manytomany
+        self.session.expunge(self.users[1])
+        self.session.expunge(self.users[2])
+        items = to_manytomany(User, self.ids, self.session,
+                              [self.users[0]])
+        self.assertEqual([i.id for i in items], self.ids)
+        self.assertEqual(len(self.queries), 1)
+
+    def test_chunks(self):
+        from formbar import converters
+        self.session.expunge_all()
+        chunksize = converters.load_items_chunksize
+        converters.load_items_chunksize = 2
+        try:
+            items = converters.to_manytomany(User, self.ids, self.session,
+                                             [])
+        finally:
+            converters.load_items_chunksize = chunksize
+        self.assertEqual([i.id for i in items], self.ids)
+        self.assertEqual(len(self.queries), 2)
+
+    def test_remove(self):
+        from formbar.converters import to_manytomany
+        items = to_manytomany(User, self.ids[1:], self.session,
+                              self.users[:2])
+        self.assertEqual(items, self.users[1:])
+
+    def test_missing(self):
+        from formbar.converters import to_manytomany
+        from sqlalchemy.orm.exc import NoResultFound
+        missing = max(self.ids) + 1
+        try:
+            to_manytomany(User, self.ids + [missing], self.session, [])
+        except NoResultFound as e:
+            self.assertTrue(str(missing) in str(e))
+        else:
+            self.fail("NoResultFound not raised")
+
+    def test_deleted(self):
+        from formbar.converters import to_manytomany
+        from sqlalchemy.orm.exc import NoResultFound
+        self.session.delete(self.users[1])
+        self.assertRaises(NoResultFound, to_manytomany, User,
+                          self.ids, self.session, [])
+        self.session.flush()
+        self.assertRaises(NoResultFound, to_manytomany, User,
+                          self.ids, self.session, [])
+
+    def test_duplicate_ids(self):
+        from formbar.converters import to_manytomany
+        items = to_manytomany(User, self.ids + self.ids, self.session,
+                              [self.users[0]])
+        self.assertEqual(items, self.users)
+
+
+class TestOptionCache(unittest.TestCase):
+
+    def setUp(self):
+        from formbar.options import OptionCache
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.session.query(User).delete()
+        self.session.add_all([User(u"a", u"A"), User(u"b", u"B")])
+        self.session.commit()
+        self.cache = OptionCache()
+
+    def tearDown(self):
+        self.session.query(User).delete()
+        self.session.commit()
+        Session.remove()
+
+    def test_cached(self):
+        query = self.session.query(User)
+        options = self.cache.get(User, ["fullname"], query)
+        self.assertEqual([o.fullname for o in options], [u"A", u"B"])
+        self.assertEqual(unicode(options[0]), unicode(query.first()))
+        self.assertTrue(self.cache.get(User, ["fullname"], query) is options)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1,
+                                              "invalidations": 0,
+                                              "size": 1})
+
+    def test_invalidate_on_flush(self):
+        query = self.session.query(User)
+        self.cache.get(User, [], query)
+        self.session.add(User(u"c"))
+        self.session.flush()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(len(self.cache.get(User, [], query)), 3)
+
+    def test_limits(self):
+        query = self.session.query(User)
+        self.cache.max_rows = 1
+        self.cache.get(User, [], query)
+        self.assertEqual(len(self.cache), 0)
+        self.cache.max_rows = 10
+        self.cache.ttl = 0
+        self.cache.get(User, [], query)
+        self.cache.get(User, [], query)
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+
+class TestRelationSearch(unittest.TestCase):
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.session.query(User).delete()
+        self.users = [User(name) for name
+                      in [u"Anna", u"anton", u"Bert", u"a_b", u"Andrea"]]
+        self.session.add_all(self.users)
+        self.session.flush()
+        self.task = Task(owner=self.users[2])
+
+    def tearDown(self):
+        self.session.rollback()
+        Session.remove()
+
+    def _get_field(self, attributes="", search='search="name"'):
+        tree = etree.fromstring(
+            '<configuration><source>'
+            '<entity id="e1" name="owner">'
+            '<renderer type="dropdown" %s pagesize="2" %s/>'
+            '</entity></source><form id="f"><field ref="e1"/></form>'
+            '</configuration>' % (search, attributes))
+        form = Form(Config(tree).get_form("f"), self.task, self.session)
+        return form.get_field("owner")
+
+    def _names(self, result):
+        names = dict((u.id, u.name) for u in self.users)
+        return [names[o["value"]] for o in result["options"]]
+
+    def test_search(self):
+        field = self._get_field()
+        self.assertTrue(field.is_searchable())
+        result = field.search_options(u"an")
+        self.assertEqual(self._names(result), [u"Andrea", u"Anna"])
+        self.assertTrue(result["more"])
+        self.assertEqual(result["options"][0]["label"],
+                         unicode(self.users[4]))
+        result = field.search_options(u"an", 2)
+        self.assertEqual(self._names(result), [u"anton"])
+        self.assertFalse(result["more"])
+        self.assertEqual(field.search_options(u"an", "x")["page"], 1)
+
+    def test_escape(self):
+        field = self._get_field()
+        self.assertEqual(self._names(field.search_options(u"a_")),
+                         [u"a_b"])
+
+    def test_filter(self):
+        field = self._get_field('filter="%name != \'Andrea\'"')
+        result = field.search_options(u"a")
+        self.assertEqual(self._names(result), [u"Anna", u"a_b"])
+        self.assertTrue(result["more"])
+        result = field.search_options(u"a", 2)
+        self.assertEqual(self._names(result), [u"anton"])
+        self.assertFalse(result["more"])
+
+    def test_options_filtered_in_db(self):
+        field = self._get_field('filter="%name in [\'Anna\', \'Bert\']"',
+                                search="")
+        self.assertTrue(field._get_filter_criterion(User) is not None)
+        passed = [o[1] for o in field.get_options() if o[2]]
+        self.assertEqual(sorted(passed), sorted([self.users[0].id,
+                                                 self.users[2].id, ""]))
+
+    def test_filter_fallback(self):
+        # Comparisons of two attributes are evaluated in Python.
+        field = self._get_field('filter="%name != %fullname"')
+        self.assertTrue(field._get_filter_criterion(User) is None)
+        self.assertEqual(self._names(field.search_options(u"b")),
+                         [u"Bert"])
+
+    def test_label_column(self):
+        from formbar.options import Option
+        field = self._get_field('labelcolumn="name"',
+                                search="")
+        statements = []
+        log = lambda conn, cursor, statement, *args: \
+            statements.append(statement)
+        sa.event.listen(engine, "before_cursor_execute", log)
+        try:
+            options = field.get_options()[1:]
+        finally:
+            sa.event.remove(engine, "before_cursor_execute", log)
+        self.assertTrue(all(isinstance(o[0], Option) for o in options))
+        self.assertEqual(sorted(unicode(o[0]) for o in options),
+                         sorted(u.name for u in self.users))
+        self.assertEqual(len(statements), 1)
+        self.assertFalse("fullname" in statements[0])
+
+    def test_option_cache(self):
+        from formbar.options import Option, option_cache
+        field = self._get_field(search="")
+        self.assertTrue(all(isinstance(o[0], User)
+                            for o in field.get_options()[1:]))
+        option_cache.clear()
+        field = self._get_field('cache="true"', search="")
+        options = field.get_options()[1:]
+        self.assertTrue(all(isinstance(o[0], Option) for o in options))
+        self.assertEqual(sorted(o[1] for o in options),
+                         sorted(u.id for u in self.users))
+        self.assertEqual(option_cache.stats()["size"], 1)
+        option_cache.clear()
+
+    def test_label_column_search(self):
+        field = self._get_field('labelcolumn="name"')
+        result = field.search_options(u"b")
+        self.assertEqual(result["options"],
+                         [{"value": self.users[2].id, "label": u"Bert"}])
+        field = self._get_field('labelcolumn="name" '
+                                'filter="%name != %fullname"')
+        self.assertEqual(field.search_options(u"b")["options"],
+                         result["options"])
+
+    def test_selected_options(self):
+        field = self._get_field()
+        html = field._form.render()
+        self.assertTrue('formbar-search' in html)
+        self.assertEqual(html.count("<option"), 2)
+        options = field.get_options()
+        self.assertEqual([o[1] for o in options], ["", self.users[2].id])
+
+
+class TestFilterCompiler(unittest.TestCase):
+
+    expressions = [
+        "$name == 'a'", "'a' == $name", "$name != 'a'",
+        "$fullname == 'A'", "$fullname != 'A'", "$password == '1'",
+        "$password != '1'", "$name in ['a', 'b']",
+        "$password in ['1', '2', 'x']", "not ($fullname == 'A')",
+        "$name == 'a' or $fullname == 'B'",
+        "$name != 'a' and $fullname != 'B' and $password != '2'",
+        "($name == 'a' or $name == 'b') and not ($password == '1')",
+    ]
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.session.query(User).delete()
+        self.users = [User(u"a", u"A", 1), User(u"b", None, 2),
+                      User(u"c", u"B", None), User(u"a", None, None)]
+        self.session.add_all(self.users)
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+        Session.remove()
+
+    def test_same_results(self):
+        from formbar.rules import Rule
+        from formbar.filtercompiler import compile_filter
+        for expression in self.expressions:
+            rule = Rule(expression)
+            criterion = compile_filter(rule._expression_tree, User)
+            passed = set(id for id, in
+                         self.session.query(User.id).filter(criterion))
+            for user in self.users:
+                values = dict((key, unicode(getattr(user, key)))
+                              for key in ("name", "fullname", "password"))
+                self.assertEqual(user.id in passed, rule.evaluate(values),
+                                 "%s %s" % (expression, values))
+
+    def test_not_supported(self):
+        from formbar.rules import Rule
+        from formbar.rulecompiler import CompileError
+        from formbar.filtercompiler import compile_filter
+        for expression in ["$name == $fullname", "$name == None",
+                           "$password gt '1'", "$password == 1",
+                           "$password == '01'",
+                           "$missing == 'a'", "$name.foo == 'a'",
+                           "len($name) gt 1", "$name == 'None'",
+                           "$name == 'a' and $name == 'b' or $name"]:
+            self.assertRaises(CompileError, compile_filter,
+                              Rule(expression)._expression_tree, User)
+
+
+class TestPropertyCache(unittest.TestCase):
+
+    def setUp(self):
+        from formbar.fields import PropertyCache
+        self.cache = PropertyCache()
+
+    def test_get_property(self):
+        import sqlalchemy as sa
+        prop = self.cache.get_property(User, "name")
+        self.assertTrue(prop is sa.orm.class_mapper(User).get_property("name"))
+        self.assertTrue(self.cache.get_property(User, "name") is prop)
+        self.assertEqual(self.cache.get_property(User, "missing"), None)
+        self.assertEqual(self.cache.get_type(prop), "string")
+        self.assertEqual(self.cache.get_related_class(User, "name"), None)
+
+    def test_cleared_on_configure(self):
+        import sqlalchemy as sa
+        self.cache.get_property(User, "name")
+
+        class Group(Base):
+            __tablename__ = 'groups'
+            id = Column(Integer, primary_key=True)
+
+        sa.orm.configure_mappers()
+        self.assertEqual(self.cache._classes, {})
+
+
 if __name__ == '__main__':
     unittest.main()
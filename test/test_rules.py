@@ -0,0 +1,129 @@
+import unittest
+from formbar import rules
+from formbar.rules import (
+    Rule, BoolRule, Expression, ExpressionCache, expression_cache
+)
+from formbar.rulecompiler import compile_tree
+
+
+class TestExpressionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ExpressionCache(maxsize=2)
+
+    def test_parse_once(self):
+        tree = self.cache.get("$a gt 1")
+        self.assertTrue(self.cache.get("$a gt 1") is tree)
+        self.assertEqual(self.cache.stats(),
+                         {"hits": 1, "misses": 1, "size": 1})
+
+    def test_lru_eviction(self):
+        self.cache.get("$a gt 1")
+        self.cache.get("$b gt 1")
+        self.cache.get("$a gt 1")
+        self.cache.get("$c gt 1")
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get("$a gt 1")
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    def test_shared_tree(self):
+        rule1 = Rule("$a gt 1")
+        rule2 = Rule("$a gt 1", msg="Other message")
+        self.assertTrue(rule1._expression_tree is rule2._expression_tree)
+        self.assertTrue(rule1.evaluate({"a": 2}))
+        self.assertFalse(rule2.evaluate({"a": 1}))
+
+    def test_expression(self):
+        misses = expression_cache.stats()["misses"]
+        Expression("$unique_x + 1")
+        expr = Expression("$unique_x + 1")
+        self.assertEqual(expr.evaluate({"unique_x": 1}), 2)
+        self.assertEqual(expression_cache.stats()["misses"], misses + 1)
+
+
+class TestRuleCompiler(unittest.TestCase):
+
+    expressions = [
+        "$a == 1", "$a gt 1", "$a ge 1 and $b == 'x'",
+        "$a == 1 or $b == 'x'", "$a == 1 or $b == 'x' or $c",
+        "$a == 1 and $b == 'x' or $c", "not $c", "not ($a == 1)",
+        "$a + $a * 2 - 1", "$a / 2", "$d / 2.0", "$b in ['x', 'y']",
+        "len($b) gt 0", "bool($b)", "float($a) ge 1.0",
+        "date('20150101') lt date('today')", "$missing == None",
+        "($a == 1) == ($c == True)", "$c and $a", "$a == 'x'",
+    ]
+    values = [
+        {"a": 1, "b": u"x", "c": True, "d": 3.0},
+        {"a": 2, "b": u"y", "c": False, "d": 1.0},
+        {"a": 0, "b": u"", "c": True, "d": 0.0},
+    ]
+
+    def _evaluate(self, func, values):
+        try:
+            return func(values), None
+        except Exception as ex:
+            return None, type(ex)
+
+    def test_same_results(self):
+        for expression in self.expressions:
+            expr = Expression(expression)
+            compiled = compile_tree(expr._expression_tree, expression)
+            for values in self.values:
+                interpreted = self._evaluate(
+                    lambda v: expr._evaluate(expr._expression_tree, v),
+                    values)
+                self.assertEqual(self._evaluate(compiled, values),
+                                 interpreted,
+                                 "%s %s" % (expression, values))
+
+    def test_type_mismatch(self):
+        expr = Expression("$a == 'x'")
+        compiled = compile_tree(expr._expression_tree, "$a == 'x'")
+        self.assertRaises(TypeError, compiled, {"a": 1})
+
+    def test_enable_compiler(self):
+        rule = Rule("$a ge 1 and $b == 'x'")
+        rules.enable_compiler()
+        try:
+            self.assertTrue(rule.evaluate({"a": 1, "b": u"x"}))
+            self.assertFalse(rule.evaluate({"a": 0, "b": u"x"}))
+            self.assertTrue(rule._compiled is not None)
+        finally:
+            rules.enable_compiler(False)
+        self.assertTrue(Rule("$a ge 1")._compiled is None)
+
+
+class TestConstraintRule(unittest.TestCase):
+
+    def test_default_msg(self):
+        for name, value in (("minlength", 3), ("maxlength", 3),
+                            ("min", 3), ("max", 3), ("pattern", "[a-z]+"),
+                            ("options", ["a", "b"])):
+            rule = rules.constraint_rules[name]("x", value)
+            self.assertTrue(rule.msg.startswith('Constraint "'))
+            self.assertEqual(rule.triggers, "error")
+
+
+class TestBoolRule(unittest.TestCase):
+
+    def test_same_results(self):
+        values = [u"", u"''", u"foo", u"  ", [], [u""], [u"1"], 0, 1.0,
+                  None, True, False]
+        native = BoolRule("a")
+        interpreted = Rule("bool($a)")
+        for value in values:
+            self.assertEqual(native.evaluate({"a": value}),
+                             interpreted.evaluate({"a": value}),
+                             repr(value))
+        self.assertEqual(native.evaluate({}), interpreted.evaluate({}))
+
+    def test_string(self):
+        rule = BoolRule("a", "Required", triggers="warning")
+        self.assertEqual(repr(rule),
+                         repr(Rule("bool($a)", triggers="warning")))
+        self.assertEqual(rule.mode, "pre")
+        self.assertTrue(rule.desired)
+
+
+if __name__ == '__main__':
+    unittest.main()